@@ -0,0 +1,20 @@
+"""ASGI-точка входа приложения.
+
+Запуск: python run.py serve, либо напрямую
+gunicorn -c gunicorn.conf.py или uvicorn asgi:application.
+
+Flask выполняется в пуле из WSGI_THREADS потоков a2wsgi, поэтому воркер
+uvicorn обслуживает запросы параллельно, и медленный потоковый ответ не
+задерживает остальные. После отправки ответа a2wsgi вызывает его close(),
+от которого зависят метрики запроса и закрытие файлов статики.
+"""
+
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from run import app, warm
+
+warm()
+
+application = WSGIMiddleware(app, workers=int(os.environ.get("WSGI_THREADS", 10)))
@@ -0,0 +1,529 @@
+"""Сборка статики: минификация, хеши в именах файлов и предсжатые копии.
+
+Результат кладется в static/dist/ с той же структурой каталогов, что и
+исходники, а manifest.json сопоставляет исходное имя с хешированным:
+
+    {"css/styles.css": "css/styles.3f9a1c2b7e.css", ...}
+
+Рядом пишется critical.css - стили первого экрана для встраивания в <head>,
+и sources.txt - хеш исходников, по которому видно, что сборка устарела.
+Сторонние иконки и шрифты скачиваются и урезаются до используемых глифов
+в static/vendor/ отдельным шагом fetch_vendor (нужен fontTools).
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import posixpath
+import re
+import urllib.request
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin, urlparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+CRITICAL_NAME = "critical.css"
+SOURCES_NAME = "sources.txt"
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".ttf"}
+
+VENDOR_DIR = "vendor"
+DEVICON_CSS_URL = "https://cdn.jsdelivr.net/gh/devicons/devicon@v2.16.0/devicon.min.css"
+JETBRAINS_MONO_URL = (
+    "https://github.com/JetBrains/JetBrainsMono/raw/v2.304/fonts/ttf/"
+    "JetBrainsMono-{style}.ttf"
+)
+JETBRAINS_MONO_STYLES = {400: "Regular", 700: "Bold"}
+
+SVG_NS = "http://www.w3.org/2000/svg"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+EDITOR_NAMESPACES = (
+    "http://www.inkscape.org/namespaces/inkscape",
+    "http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd",
+    "http://svgjs.dev/svgjs",
+)
+# Наследуемые атрибуты, которые можно поднять с дочерних элементов на <g>;
+# opacity не наследуется: на <g> группа смешивалась бы целиком
+INHERITED_ATTRS = ("fill", "stroke", "stroke-width", "stroke-linecap")
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+CSS_COMMENT_OR_STRING = re.compile(
+    r"""/\*.*?\*/|"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'""", flags=re.S
+)
+CSS_PLACEHOLDER = re.compile("\x00(\\d+)\x00")
+
+
+def minify_css(source):
+    """Удаляет комментарии и лишние пробелы; строки остаются как есть"""
+    strings = []
+
+    def protect(match):
+        if match.group().startswith("/*"):
+            return ""
+        strings.append(match.group())
+        return f"\x00{len(strings) - 1}\x00"
+
+    source = CSS_COMMENT_OR_STRING.sub(protect, source)
+    source = re.sub(r"\s+", " ", source)
+    source = re.sub(r"\s*([{};,>])\s*", r"\1", source)
+    source = re.sub(r":\s+", ":", source)
+    source = source.replace(";}", "}")
+    return CSS_PLACEHOLDER.sub(lambda match: strings[int(match.group(1))], source.strip())
+
+
+def minify_js(source):
+    """Удаляет комментарии и отступы, сохраняя переводы строк.
+
+    Строки, шаблонные строки и литералы регулярных выражений переносятся
+    как есть, поэтому перевод строк не ломает автоподстановку ';'.
+    """
+    # Куски кода и литералов; отступы и пустые строки убираются только в коде
+    out = []
+    code = []
+    i, n = 0, len(source)
+    last = ""
+    while i < n:
+        c = source[i]
+        if c in "'\"`":
+            j = i + 1
+            while j < n and source[j] != c:
+                j += 2 if source[j] == "\\" else 1
+            out.append(_strip_js_lines("".join(code)))
+            out.append(source[i : j + 1])
+            code = []
+            last = c
+            i = j + 1
+        elif source.startswith("//", i):
+            i = source.find("\n", i)
+            i = n if i == -1 else i
+            continue
+        elif source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        elif c == "/" and last in "(,=:[!&|?{};+-*%<>~^":
+            j, in_class = i + 1, False
+            while j < n and (in_class or source[j] != "/"):
+                if source[j] == "\\":
+                    j += 1
+                elif source[j] == "[":
+                    in_class = True
+                elif source[j] == "]":
+                    in_class = False
+                j += 1
+            out.append(_strip_js_lines("".join(code)))
+            out.append(source[i : j + 1])
+            code = []
+            last = "/"
+            i = j + 1
+        else:
+            code.append(c)
+            if not c.isspace():
+                last = c
+            i += 1
+    out.append(_strip_js_lines("".join(code)))
+    return "".join(out).strip()
+
+
+def _strip_js_lines(code):
+    """Убирает отступы, хвостовые пробелы и пустые строки в куске кода"""
+    return re.sub(r"[ \t]*\n\s*", "\n", code)
+
+
+def _compact_attr(name, value):
+    value = re.sub(r",\s+", ",", value.strip())
+    value = re.sub(r"url\((['\"])(.*?)\1\)", r"url(\2)", value)
+    if name in ("d", "points", "transform", "viewBox", "opacity", "stroke-width"):
+        value = re.sub(r"(?<![\d.])0\.(\d)", r".\1", value)
+        value = re.sub(r"\s+(-)", r"\1", value)
+    return value
+
+
+def optimize_svg(source):
+    """Удаляет комментарии, метаданные, атрибуты редакторов и пробелы.
+
+    Одинаковые у всех дочерних элементов наследуемые атрибуты поднимаются
+    на родительскую группу.
+    """
+    ET.register_namespace("", SVG_NS)
+    ET.register_namespace("xlink", XLINK_NS)
+    root = ET.fromstring(source)
+
+    for parent in root.iter():
+        for child in list(parent):
+            tag = child.tag if isinstance(child.tag, str) else ""
+            if tag == f"{{{SVG_NS}}}metadata" or tag.startswith(
+                tuple(f"{{{ns}}}" for ns in EDITOR_NAMESPACES)
+            ):
+                parent.remove(child)
+
+    for element in root.iter():
+        for name in list(element.attrib):
+            if name.startswith(tuple(f"{{{ns}}}" for ns in EDITOR_NAMESPACES)):
+                del element.attrib[name]
+            else:
+                element.attrib[name] = _compact_attr(name, element.attrib[name])
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+
+    for element in root.iter(f"{{{SVG_NS}}}g"):
+        children = list(element)
+        if len(children) < 2:
+            continue
+        for name in INHERITED_ATTRS:
+            values = {child.attrib.get(name) for child in children}
+            if len(values) == 1 and None not in values and name not in element.attrib:
+                element.attrib[name] = values.pop()
+                for child in children:
+                    del child.attrib[name]
+
+    root.attrib.pop("version", None)
+    return ET.tostring(root, encoding="unicode").replace(" />", "/>")
+
+
+def _hashed_name(name, data):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def _write(path, data):
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _emit(output_dir, manifest, name, data):
+    hashed = _hashed_name(name, data)
+    manifest[name] = hashed
+    target = os.path.join(output_dir, hashed)
+    _write(target, data)
+    if os.path.splitext(name)[1] in COMPRESSIBLE:
+        _write(f"{target}.gz", gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(f"{target}.br", brotli.compress(data, quality=11))
+
+
+def _rewrite_css_urls(css, name, manifest):
+    base = os.path.dirname(name)
+
+    def replace(match):
+        url = match.group(2)
+        if "://" in url or url.startswith(("data:", "/", "#")):
+            return match.group(0)
+        path, _, suffix = url.partition("#")
+        source = os.path.normpath(os.path.join(base, path))
+        if source not in manifest:
+            return match.group(0)
+        hashed = os.path.relpath(manifest[source], base or ".")
+        return f"url({hashed}{'#' + suffix if suffix else ''})"
+
+    return CSS_URL.sub(replace, css)
+
+
+def _sources(static_folder, output_dir, exclude, generated):
+    sources = []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [
+            d for d in dirs if os.path.join(root, d) != os.path.normpath(output_dir)
+        ]
+        for filename in files:
+            name = os.path.relpath(os.path.join(root, filename), static_folder)
+            if name.replace(os.sep, "/") not in exclude:
+                sources.append(name.replace(os.sep, "/"))
+    sources += [name for name in generated if name not in sources]
+    return sources
+
+
+def source_digest(static_folder, output_dir, exclude=(), generated=None, config=None):
+    """Хеш всего, от чего зависит сборка.
+
+    Учитываются исходники, generated, config и код самого сборщика, поэтому
+    исправление минификатора тоже делает прошлую сборку устаревшей.
+    """
+    generated = generated or {}
+    digest = hashlib.sha256()
+    with open(__file__, "rb") as f:
+        digest.update(f.read())
+    digest.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    for name in sorted(_sources(static_folder, output_dir, exclude, generated)):
+        digest.update(f"\0{name}\0".encode("utf-8"))
+        if name in generated:
+            digest.update(generated[name].encode("utf-8"))
+        else:
+            with open(os.path.join(static_folder, name), "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def save_source_digest(output_dir, digest):
+    """Отмечает сборку в output_dir как собранную из исходников с хешем digest"""
+    _write(os.path.join(output_dir, SOURCES_NAME), digest.encode("ascii"))
+
+
+def build(static_folder, output_dir, exclude=(), generated=None):
+    """Собирает все файлы static_folder в output_dir и пишет манифест.
+
+    generated - {имя: текст} файлов, которых нет в static_folder, но которые
+    собираются и хешируются наравне с ними.
+    """
+    generated = generated or {}
+    previous = load_manifest(output_dir)
+    sources = _sources(static_folder, output_dir, exclude, generated)
+
+    # CSS собирается последним, чтобы url() указывали на хешированные файлы
+    sources.sort(key=lambda name: (name.endswith(".css"), name))
+    manifest = {}
+    for name in sources:
+        if name in generated:
+            data = generated[name].encode("utf-8")
+        else:
+            with open(os.path.join(static_folder, name), "rb") as f:
+                data = f.read()
+        if name.endswith(".css"):
+            css = _rewrite_css_urls(minify_css(data.decode("utf-8")), name, manifest)
+            data = css.encode("utf-8")
+        elif name.endswith(".js"):
+            data = minify_js(data.decode("utf-8")).encode("utf-8")
+        elif name.endswith(".svg"):
+            data = optimize_svg(data.decode("utf-8")).encode("utf-8")
+        _emit(output_dir, manifest, name, data)
+
+    # Файлы предыдущей сборки остаются для клиентов со старым HTML,
+    # все более старые удаляются
+    keep = set(manifest.values()) | set(previous.values())
+    for root, _, files in os.walk(output_dir):
+        for filename in files:
+            name = os.path.relpath(os.path.join(root, filename), output_dir)
+            name = name.replace(os.sep, "/")
+            if name not in (MANIFEST_NAME, CRITICAL_NAME, SOURCES_NAME) and re.sub(r"\.(gz|br)$", "", name) not in keep:
+                os.remove(os.path.join(root, filename))
+
+    _write(
+        os.path.join(output_dir, MANIFEST_NAME),
+        json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"),
+    )
+    return manifest
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _split_rules(css):
+    """Разбивает минифицированный CSS на пары (прелюдия, тело) верхнего уровня"""
+    rules = []
+    i = 0
+    while True:
+        start = css.find("{", i)
+        if start == -1:
+            return rules
+        depth, end = 1, start + 1
+        while depth and end < len(css):
+            depth += {"{": 1, "}": -1}.get(css[end], 0)
+            end += 1
+        rules.append((css[i:start].strip(), css[start + 1 : end - 1]))
+        i = end
+
+
+def _selector_matches(selector, tokens):
+    selector = selector.strip()
+    for token in tokens:
+        if token.endswith("-"):
+            if selector.startswith(token):
+                return True
+        elif re.match(rf"{re.escape(token)}(?![\w-])", selector):
+            return True
+    return False
+
+
+def extract_critical(css, tokens):
+    """Оставляет правила, селекторы которых начинаются с одного из tokens.
+
+    Токен, оканчивающийся на "-", работает как префикс класса (".nav-").
+    Правила внутри @media фильтруются так же, прочие @-правила отбрасываются.
+    """
+    out = []
+    for prelude, body in _split_rules(css):
+        if prelude.startswith("@media"):
+            inner = extract_critical(body, tokens)
+            if inner:
+                out.append(f"{prelude}{{{inner}}}")
+        elif not prelude.startswith("@"):
+            selectors = [s for s in prelude.split(",") if _selector_matches(s, tokens)]
+            if selectors:
+                out.append(f"{','.join(selectors)}{{{body}}}")
+    return "".join(out)
+
+
+def _absolute_css_urls(css, hashed_name, url_prefix):
+    base = posixpath.dirname(hashed_name)
+
+    def replace(match):
+        url = match.group(2)
+        if "://" in url or url.startswith(("data:", "/", "#")):
+            return match.group(0)
+        return f"url({url_prefix}{posixpath.normpath(posixpath.join(base, url))})"
+
+    return CSS_URL.sub(replace, css)
+
+
+def write_critical_css(output_dir, manifest, url_prefix, inline=(), extract=None):
+    """Собирает critical.css для встраивания в страницу.
+
+    inline - собранные CSS, встраиваемые целиком (шрифты, иконки),
+    extract - {CSS: токены} для выборки стилей первого экрана. Ссылки
+    url() переписываются в абсолютные, так как стили окажутся в HTML.
+    """
+    parts = []
+    sources = [(name, None) for name in inline] + list((extract or {}).items())
+    for name, tokens in sources:
+        hashed = manifest.get(name)
+        if hashed is None:
+            continue
+        with open(os.path.join(output_dir, hashed), encoding="utf-8") as f:
+            css = f.read()
+        if tokens is not None:
+            css = extract_critical(css, tokens)
+        parts.append(_absolute_css_urls(css, hashed, url_prefix))
+    _write(os.path.join(output_dir, CRITICAL_NAME), "".join(parts).encode("utf-8"))
+
+
+def _download(url, cache_dir):
+    name = os.path.basename(urlparse(url).path)
+    path = os.path.join(cache_dir, f"{hashlib.sha256(url.encode()).hexdigest()[:12]}-{name}")
+    if not os.path.exists(path):
+        logger.info(f"Загрузка {url}")
+        with urllib.request.urlopen(url, timeout=30) as response:
+            _write(path, response.read())
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _subset_font(data, unicodes):
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+
+    logging.getLogger("fontTools").setLevel(logging.WARNING)
+    options = subset.Options()
+    options.flavor = "woff2"
+    font = TTFont(io.BytesIO(data))
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=unicodes)
+    subsetter.subset(font)
+    out = io.BytesIO()
+    subset.save_font(font, out, options)
+    return out.getvalue()
+
+
+def _devicon_subset(css, icons):
+    """Выбирает из devicon.min.css правила для icons и их кодовые точки"""
+    pattern = re.compile(
+        r"\.devicon-(?:%s)(?![\w-])" % "|".join(re.escape(icon) for icon in icons)
+    )
+    font_url, rules, codepoints = None, [], set()
+    for prelude, body in _split_rules(minify_css(css)):
+        if prelude == "@font-face":
+            match = re.search(r"""url\(['"]?([^'")?#]+\.ttf)""", body)
+            font_url = match and match.group(1)
+        elif prelude.startswith("[class"):
+            rules.append(f"{prelude}{{{body}}}")
+        else:
+            selectors = [s for s in prelude.split(",") if pattern.search(s)]
+            if selectors:
+                rules.append(f"{','.join(selectors)}{{{body}}}")
+                for code in re.findall(r'content:"\\([0-9a-fA-F]+)"', body):
+                    codepoints.add(int(code, 16))
+    return font_url, rules, codepoints
+
+
+def fetch_vendor(static_folder, cache_dir, icons, text):
+    """Скачивает devicon и JetBrains Mono и урезает их до нужных глифов.
+
+    icons - имена иконок без префикса ("rust-plain", "github-original"),
+    text - весь текст сайта, по которому выбираются глифы шрифта.
+    Результат пишется в static/vendor/ и дальше собирается как обычная
+    статика.
+    """
+    vendor_dir = os.path.join(static_folder, VENDOR_DIR)
+
+    css = _download(DEVICON_CSS_URL, cache_dir).decode("utf-8")
+    font_url, rules, codepoints = _devicon_subset(css, sorted(icons))
+    if font_url is None:
+        raise RuntimeError(f"В {DEVICON_CSS_URL} не найден шрифт devicon")
+    font = _download(urljoin(DEVICON_CSS_URL, font_url), cache_dir)
+    _write(os.path.join(vendor_dir, "devicon.woff2"), _subset_font(font, codepoints))
+    face = (
+        '@font-face{font-family:"devicon";font-style:normal;font-weight:normal;'
+        'font-display:block;src:url(devicon.woff2) format("woff2")}'
+    )
+    _write(
+        os.path.join(vendor_dir, "devicon.css"),
+        (face + "".join(rules)).encode("utf-8"),
+    )
+
+    unicodes = {ord(c) for c in text if not c.isspace()} | set(range(0x20, 0x7F))
+    faces = []
+    for weight, style in JETBRAINS_MONO_STYLES.items():
+        font = _download(JETBRAINS_MONO_URL.format(style=style), cache_dir)
+        name = f"jetbrains-mono-{weight}.woff2"
+        _write(os.path.join(vendor_dir, name), _subset_font(font, unicodes))
+        faces.append(
+            '@font-face{font-family:"JetBrains Mono";font-style:normal;'
+            f"font-weight:{weight};font-display:swap;"
+            f'src:url({name}) format("woff2")}}'
+        )
+    _write(os.path.join(vendor_dir, "fonts.css"), "".join(faces).encode("utf-8"))
+    logger.info(
+        f"Подготовлены {len(codepoints)} иконок devicon и "
+        f"{len(unicodes)} символов JetBrains Mono"
+    )
+
+
+class Manifest:
+    """Манифест собранной статики; version меняется вместе с хешами файлов"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.load()
+
+    def load(self):
+        self.files = load_manifest(self.output_dir)
+        try:
+            with open(os.path.join(self.output_dir, CRITICAL_NAME), encoding="utf-8") as f:
+                self.critical_css = f.read()
+        except OSError:
+            self.critical_css = ""
+        try:
+            with open(os.path.join(self.output_dir, SOURCES_NAME), encoding="ascii") as f:
+                self.sources = f.read().strip()
+        except OSError:
+            self.sources = None
+        self.hashed = set(self.files.values())
+        self.version = hashlib.sha256(
+            json.dumps([self.files, self.critical_css], sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+
+    def get(self, name):
+        return self.files.get(name)
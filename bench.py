@@ -0,0 +1,465 @@
+"""Нагрузочные тесты и микробенчмарки сайта.
+
+Запуск: python bench.py run [--baseline benchmarks/baseline.json]
+
+Нагрузка: сервер поднимается командой run.py serve на свободном порту, и
+все страницы из site_pages() опрашиваются на каждом уровне конкурентности
+в двух режимах:
+
+- cold - кеш страниц отключен (NullCache), каждая страница рендерится;
+- warm - обычный кеш в отдельной базе, страницы прогреты при старте.
+
+Для каждого уровня считаются запросы в секунду и перцентили задержки
+p50/p95/p99, после прогона снимается RSS мастера и каждого воркера.
+
+Микробенчмарки: highlight_code по каждому лексеру на примерах кода из
+контента и рендер каждого шаблона без кеша страниц.
+
+Результат пишется в JSON. С --baseline результат сравнивается с
+сохраненным прогоном, и при регрессии больше --tolerance команда
+завершается с кодом 1; python bench.py compare сравнивает два готовых файла.
+Нагрузка сравнивается только по итогам уровней: у отдельной страницы слишком
+мало запросов. Прогоны с разными cpus, levels, workers или duration не
+сравниваются, команда завершается с кодом 2.
+"""
+
+import argparse
+import http.client
+import inspect
+import json
+import os
+import platform
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(ROOT, "build", "bench.json")
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+DEFAULT_LEVELS = (1, 4, 16)
+DEFAULT_DURATION = 5.0
+DEFAULT_WORKERS = 2
+DEFAULT_TOLERANCE = 0.15
+SERVER_START_TIMEOUT = 60.0
+ACCEPT_ENCODING = "br, gzip"
+
+# Направление метрик при сравнении: True - больше значит лучше
+METRICS = {
+    "rps": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "median_us": False,
+    "max_kb": False,
+}
+# Условия прогона, при которых результаты сравнимы
+COMPARABLE_META = ("cpus", "levels", "workers", "duration")
+CACHE_MODES = {
+    "cold": {"CACHE_TYPE": "NullCache"},
+    "warm": {"CACHE_TYPE": "cache_backends.SharedMemoryCache"},
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(port, process):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Сервер не ответил за {SERVER_START_TIMEOUT:.0f} с")
+
+
+def _children(pid):
+    """PID дочерних процессов по /proc (только Linux)"""
+    children = []
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else ():
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        if int(stat.rsplit(")", 1)[1].split()[1]) == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def memory_usage(pid):
+    workers = [
+        rss for rss in (_rss_kb(child) for child in _children(pid)) if rss is not None
+    ]
+    return {
+        "master_kb": _rss_kb(pid),
+        "workers_kb": workers,
+        "max_kb": max(workers, default=None),
+    }
+
+
+def _summary(latencies, elapsed, errors):
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+    if len(latencies) >= 2:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        for name, index in (("p50_ms", 49), ("p95_ms", 94), ("p99_ms", 98)):
+            summary[name] = round(cuts[index] * 1000, 3)
+    return summary
+
+
+def drive(port, paths, concurrency, duration):
+    """Опрашивает страницы по кругу в concurrency потоков в течение duration"""
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency + 1)
+    deadline = 0.0
+
+    def worker(offset):
+        local = defaultdict(list)
+        failed = defaultdict(int)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        barrier.wait()
+        i = offset
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path, headers={"Accept-Encoding": ACCEPT_ENCODING})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                ok = False
+            if ok:
+                local[path].append(time.perf_counter() - start)
+            else:
+                failed[path] += 1
+        conn.close()
+        with lock:
+            for path, values in local.items():
+                latencies[path].extend(values)
+            for path, count in failed.items():
+                errors[path] += count
+
+    threads = [
+        threading.Thread(target=worker, args=(n,), daemon=True)
+        for n in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.perf_counter() + duration
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total = [value for values in latencies.values() for value in values]
+    return {
+        "total": _summary(total, elapsed, sum(errors.values())),
+        "routes": {
+            path: _summary(latencies[path], elapsed, errors[path]) for path in paths
+        },
+    }
+
+
+def run_load(paths, mode, levels, duration, workers):
+    """Поднимает сервер в режиме кеша mode и прогоняет все уровни нагрузки"""
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, **CACHE_MODES[mode])
+        env["CACHE_SHM_PATH"] = os.path.join(tmp, "cache.sqlite3")
+        log_path = os.path.join(tmp, "server.log")
+        with open(log_path, "wb") as log:
+            process = subprocess.Popen(
+                [
+                    sys.executable,
+                    os.path.join(ROOT, "run.py"),
+                    "serve",
+                    "--bind",
+                    f"127.0.0.1:{port}",
+                    "--workers",
+                    str(workers),
+                ],
+                cwd=ROOT,
+                env=env,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        try:
+            try:
+                _wait_ready(port, process)
+            except RuntimeError:
+                with open(log_path, encoding="utf-8", errors="replace") as f:
+                    sys.stderr.write(f.read()[-4000:])
+                raise
+            # Каждый воркер должен принять хотя бы одно соединение до замера
+            drive(port, paths, workers, 0.5)
+            result = {"levels": {}}
+            for concurrency in levels:
+                print(f"  {mode}: {concurrency} соединений, {duration:g} с")
+                result["levels"][str(concurrency)] = drive(
+                    port, paths, concurrency, duration
+                )
+            result["memory"] = memory_usage(process.pid)
+            return result
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def _timing(func, repeat=5):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    runs = [elapsed / number for elapsed in timer.repeat(repeat, number)]
+    return {
+        "loops": number,
+        "median_us": round(statistics.median(runs) * 1e6, 2),
+        "min_us": round(min(runs) * 1e6, 2),
+    }
+
+
+def run_micro():
+    """Замеряет подсветку по каждому лексеру и рендер каждого шаблона"""
+    import run
+
+    samples = defaultdict(list)
+    for language in run.content.all():
+        for project in language.projects:
+            samples[language.slug].append(project.code_example)
+
+    highlight = {}
+    for slug, codes in sorted(samples.items()):
+        highlight[slug] = _timing(
+            lambda: [run.highlight_code(code, slug) for code in codes]
+        )
+        highlight[slug]["samples"] = len(codes)
+
+    render = {}
+    adapter = run.app.url_map.bind("localhost")
+    for path, template, _ in run.site_pages():
+        endpoint, values = adapter.match(path)
+        view = run.app.view_functions[endpoint].__wrapped__
+
+        def render_page():
+            with run.app.test_request_context(path):
+                rv = view(**values)
+                if inspect.isgenerator(rv):
+                    "".join(rv)
+
+        render[path] = _timing(render_page)
+        render[path]["template"] = template
+    return {"highlight": highlight, "render": render}
+
+
+def _site_paths():
+    import run
+
+    return [path for path, _, _ in run.site_pages()]
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(data, prefix=""):
+    """Плоский словарь "путь/к/метрике" -> значение только для сравнимых метрик"""
+    items = {}
+    for key, value in data.items():
+        name = f"{prefix}/{key}" if prefix else key
+        if key == "routes":
+            # Per-route rps при нагрузке - шум, сравниваются итоги уровней
+            continue
+        if isinstance(value, dict):
+            items.update(_flatten(value, name))
+        elif key in METRICS and isinstance(value, (int, float)):
+            items[name] = value
+    return items
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Сравнивает два прогона и возвращает список регрессий"""
+    ours = _flatten({k: current.get(k, {}) for k in ("load", "micro")})
+    theirs = _flatten({k: baseline.get(k, {}) for k in ("load", "micro")})
+    regressions = []
+    for name in sorted(ours.keys() & theirs.keys()):
+        new, old = ours[name], theirs[name]
+        if not old:
+            continue
+        change = (new - old) / old
+        higher_is_better = METRICS[name.rsplit("/", 1)[1]]
+        worse = -change if higher_is_better else change
+        if worse > tolerance:
+            regressions.append(
+                {"metric": name, "baseline": old, "current": new, "change": change}
+            )
+    return regressions
+
+
+def meta_mismatch(current, baseline):
+    """Условия прогона, которые отличаются от базового"""
+    ours, theirs = current.get("meta", {}), baseline.get("meta", {})
+    return [
+        f"{key}: {theirs.get(key)} -> {ours.get(key)}"
+        for key in COMPARABLE_META
+        if ours.get(key) != theirs.get(key)
+    ]
+
+
+def check(current, baseline, tolerance):
+    """Сравнивает с базовым прогоном и возвращает код завершения"""
+    mismatch = meta_mismatch(current, baseline)
+    if mismatch:
+        print("Базовый прогон снят в других условиях, сравнение невозможно:")
+        for line in mismatch:
+            print(f"  {line}")
+        return 2
+    regressions = compare(current, baseline, tolerance)
+    report(regressions, tolerance)
+    return 1 if regressions else 0
+
+
+def report(regressions, tolerance):
+    if not regressions:
+        print(f"Регрессий больше {tolerance:.0%} нет")
+        return
+    print(f"Регрессии больше {tolerance:.0%}:")
+    for item in regressions:
+        print(
+            f"  {item['metric']}: {item['baseline']} -> {item['current']} "
+            f"({item['change']:+.1%})"
+        )
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run_bench(args):
+    levels = [int(level) for level in args.levels.split(",")]
+    results = {
+        "meta": {
+            "revision": _git_revision(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "levels": levels,
+            "duration": args.duration,
+            "workers": args.workers,
+        }
+    }
+    if not args.skip_micro:
+        print("Микробенчмарки")
+        results["micro"] = run_micro()
+    if not args.skip_load:
+        paths = _site_paths()
+        results["load"] = {}
+        for mode in CACHE_MODES:
+            print(f"Нагрузка, кеш {mode}")
+            results["load"][mode] = run_load(
+                paths, mode, levels, args.duration, args.workers
+            )
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+    if args.baseline and os.path.exists(args.baseline):
+        return check(results, load_results(args.baseline), args.tolerance)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки async.pw")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="прогнать бенчмарки")
+    run_parser.add_argument(
+        "--levels",
+        default=",".join(map(str, DEFAULT_LEVELS)),
+        help="уровни конкурентности через запятую",
+    )
+    run_parser.add_argument(
+        "--duration",
+        type=float,
+        default=DEFAULT_DURATION,
+        help="секунд на каждый уровень",
+    )
+    run_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    run_parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    run_parser.add_argument(
+        "--baseline", help=f"сравнить с сохраненным прогоном ({DEFAULT_BASELINE})"
+    )
+    run_parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    run_parser.add_argument("--skip-load", action="store_true")
+    run_parser.add_argument("--skip-micro", action="store_true")
+
+    compare_parser = subparsers.add_parser("compare", help="сравнить два прогона")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("baseline", nargs="?", default=DEFAULT_BASELINE)
+    compare_parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        return run_bench(args)
+    return check(
+        load_results(args.current), load_results(args.baseline), args.tolerance
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
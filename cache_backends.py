@@ -0,0 +1,374 @@
+"""Бэкенды кеша для Flask-Caching с LRU-вытеснением и счетчиками попаданий.
+
+Подключаются через CACHE_TYPE = "cache_backends.<Класс>":
+
+- LocalLRUCache - в памяти процесса, для разработки и тестов;
+- SharedMemoryCache - SQLite-база в /dev/shm, одна на все воркеры
+  экземпляра приложения;
+- RedisLRUCache - Redis-совместимый сервер, общий для всех хостов.
+  С CACHE_REDIS_URL = "memory://" вместо сервера используется LocalLRUCache.
+
+Общие бэкенды хранят не pickle, а JSON с двоичными вставками (encode/decode):
+подложенная в кеш запись не может выполнить код при чтении. Поэтому в них
+кладутся только JSON-совместимые значения и bytes.
+
+Размер ограничивается CACHE_MAX_BYTES, время жизни задается для каждого
+ключа через timeout в set(), а по умолчанию берется CACHE_DEFAULT_TIMEOUT.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import stat
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask_caching.backends.base import BaseCache
+from flask_caching.backends.rediscache import RedisCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+BYTES_TAG = "__bytes__"
+
+# Время последнего обращения обновляется не чаще раза в секунду,
+# чтобы частые попадания не превращались в запись в базу
+ACCESS_RESOLUTION = 1.0
+
+
+def check_owner(path):
+    """Отказывает, если путь - симлинк или принадлежит другому пользователю"""
+    info = os.lstat(path)
+    if stat.S_ISLNK(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} принадлежит другому пользователю")
+    return info
+
+
+def private_dir(name):
+    """Каталог <SHM_DIR>/<name>-<uid>, доступный только текущему пользователю.
+
+    /dev/shm доступен на запись всем: чужой каталог с тем же именем
+    не используется.
+    """
+    path = os.path.join(SHM_DIR, f"{name}-{os.getuid()}")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if stat.S_IMODE(check_owner(path).st_mode) & 0o077:
+        raise PermissionError(f"{path} доступен другим пользователям")
+    return path
+
+
+def instance_name(instance_path):
+    """Короткое имя экземпляра приложения: у каждой копии на хосте свой кеш"""
+    return hashlib.sha256(os.path.abspath(instance_path).encode()).hexdigest()[:12]
+
+
+def encode(value):
+    """JSON-заголовок и двоичные вставки для bytes: <длина заголовка><JSON><bytes>"""
+    blobs = []
+    offset = 0
+
+    def default(obj):
+        nonlocal offset
+        if not isinstance(obj, (bytes, bytearray, memoryview)):
+            raise TypeError(f"Тип {type(obj).__name__} нельзя положить в общий кеш")
+        blobs.append(obj)
+        offset += len(obj)
+        return {BYTES_TAG: [offset - len(obj), len(obj)]}
+
+    header = json.dumps(value, default=default, separators=(",", ":")).encode("utf-8")
+    return b"".join([struct.pack("!I", len(header)), header, *blobs])
+
+
+def decode(data):
+    data = memoryview(data)
+    (size,) = struct.unpack_from("!I", data)
+    blobs = data[4 + size :]
+
+    def hook(obj):
+        if len(obj) == 1 and BYTES_TAG in obj:
+            start, length = obj[BYTES_TAG]
+            return bytes(blobs[start : start + length])
+        return obj
+
+    return json.loads(bytes(data[4 : 4 + size]), object_hook=hook)
+
+
+class JsonBytesSerializer:
+    """Сериализатор cachelib на encode/decode вместо pickle.
+
+    Целые числа, как и в RedisSerializer, хранятся строкой цифр: их
+    увеличивает INCR, на котором построены inc и dec.
+    """
+
+    def dumps(self, value):
+        if type(value) is int:
+            return str(value).encode("ascii")
+        return encode(value)
+
+    def loads(self, value):
+        if value is None:
+            return None
+        # Заголовок encode начинается с длины в 4 байтах и цифрами не бывает
+        if value.lstrip(b"-").isdigit():
+            return int(value)
+        return decode(value)
+
+
+class CacheStats:
+    """Счетчики попаданий и промахов кеша в текущем процессе"""
+
+    hits = 0
+    misses = 0
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def reset_stats(self):
+        self.hits = self.misses = 0
+
+
+class LocalLRUCache(CacheStats, BaseCache):
+    """Кеш в памяти процесса с ограничением по суммарному размеру значений"""
+
+    def __init__(self, default_timeout=300, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(default_timeout=default_timeout)
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs["max_bytes"] = config.get("CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+        return cls(*args, **kwargs)
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else 0
+
+    def _pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._size -= len(item[1])
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] and item[0] <= time.time():
+                self._pop(key)
+                item = None
+            if item is not None:
+                self._items.move_to_end(key)
+        if item is None:
+            return self._count(None)
+        return self._count(pickle.loads(item[1]))
+
+    def set(self, key, value, timeout=None):
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            return False
+        with self._lock:
+            self._pop(key)
+            self._items[key] = (self._expires(timeout), payload)
+            self._size += len(payload)
+            while self._size > self.max_bytes:
+                self._pop(next(iter(self._items)))
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and not (item[0] and item[0] <= time.time()):
+                return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._pop(key) is not None
+
+    def has(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            return item is not None and not (item[0] and item[0] <= time.time())
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+        return True
+
+
+class SharedMemoryCache(CacheStats, BaseCache):
+    """Кеш в SQLite-базе в /dev/shm, общий для всех процессов экземпляра.
+
+    База открывается в режиме WAL с mmap, поэтому чтение не блокирует
+    запись и идет напрямую из разделяемой памяти. Соединение создается
+    отдельно для каждого потока и заново после fork. По умолчанию база
+    лежит в каталоге, закрытом от других пользователей, а файл чужого
+    пользователя не открывается.
+    """
+
+    def __init__(self, path=None, default_timeout=300, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(default_timeout=default_timeout)
+        self.path = path or os.path.join(private_dir("async-pw"), "cache.sqlite3")
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._db().execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL, "
+            "accessed REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._db().execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)"
+        )
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs["path"] = config.get("CACHE_SHM_PATH") or os.path.join(
+            private_dir("async-pw"), f"cache-{instance_name(app.instance_path)}.sqlite3"
+        )
+        kwargs["max_bytes"] = config.get("CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+        return cls(*args, **kwargs)
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            try:
+                check_owner(self.path)
+            except PermissionError:
+                db.close()
+                raise
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+            db.execute(f"PRAGMA mmap_size={self.max_bytes * 2}")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _evict(self, db, now):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        db.execute("DELETE FROM cache WHERE expires > 0 AND expires <= ?", (now,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        rows = db.execute("SELECT key, size FROM cache ORDER BY accessed")
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        db.executemany("DELETE FROM cache WHERE key = ?", evicted)
+
+    def get(self, key):
+        try:
+            db = self._db()
+            row = db.execute(
+                "SELECT value, expires, accessed FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or (row[1] and row[1] <= now):
+                return self._count(None)
+            if now - row[2] > ACCESS_RESOLUTION:
+                db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка чтения кеша {self.path}: {e}")
+            return self._count(None)
+        return self._count(decode(row[0]))
+
+    def _store(self, key, value, timeout, replace):
+        payload = encode(value)
+        if len(payload) > self.max_bytes:
+            return False
+        timeout = self._normalize_timeout(timeout)
+        now = time.time()
+        expires = now + timeout if timeout > 0 else 0
+        try:
+            with self._transaction() as db:
+                if not replace:
+                    db.execute(
+                        "DELETE FROM cache WHERE key = ? AND expires > 0 "
+                        "AND expires <= ?",
+                        (key, now),
+                    )
+                cursor = db.execute(
+                    f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO cache "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, expires, now, len(payload)),
+                )
+                self._evict(db, now)
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка записи в кеш {self.path}: {e}")
+            return False
+        return cursor.rowcount == 1
+
+    def set(self, key, value, timeout=None):
+        return self._store(key, value, timeout, replace=True)
+
+    def add(self, key, value, timeout=None):
+        return self._store(key, value, timeout, replace=False)
+
+    def delete(self, key):
+        cursor = self._db().execute("DELETE FROM cache WHERE key = ?", (key,))
+        return cursor.rowcount == 1
+
+    def has(self, key):
+        row = self._db().execute(
+            "SELECT 1 FROM cache WHERE key = ? AND (expires = 0 OR expires > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def clear(self):
+        self._db().execute("DELETE FROM cache")
+        return True
+
+
+class RedisLRUCache(CacheStats, RedisCache):
+    """Кеш в Redis-совместимом сервере со счетчиками попаданий.
+
+    Настройки сервера приложение не меняет: ограничение памяти и политика
+    вытеснения (maxmemory, allkeys-lru) задаются в конфигурации Redis.
+    """
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        if config.get("CACHE_REDIS_URL") == "memory://":
+            return LocalLRUCache.factory(app, config, args, kwargs)
+        return super().factory(app, config, args, kwargs)
+
+    serializer = JsonBytesSerializer()
+
+    def get(self, key):
+        return self._count(super().get(key))
+
+    def get_many(self, *keys):
+        return [self._count(value) for value in super().get_many(*keys)]
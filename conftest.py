@@ -0,0 +1,2 @@
+# Корневой conftest: pytest добавляет его каталог в sys.path, и тесты
+# импортируют модули приложения и при запуске просто pytest
@@ -0,0 +1,27 @@
+"""Настройки production-сервера gunicorn.
+
+Значения по умолчанию переопределяются переменными окружения.
+"""
+
+import multiprocessing
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = "asgi:application"
+worker_class = "uvicorn_worker.UvicornWorker"
+
+bind = os.environ.get("BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+backlog = int(os.environ.get("BACKLOG", 2048))
+
+# Контент, подсветка и отрендеренные страницы готовятся один раз в мастере
+# и разделяются воркерами через copy-on-write
+preload_app = True
+
+keepalive = int(os.environ.get("KEEPALIVE", 5))
+timeout = int(os.environ.get("TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+max_requests = int(os.environ.get("MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 0))
+
+accesslog = os.environ.get("ACCESS_LOG")
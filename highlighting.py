@@ -0,0 +1,98 @@
+"""Компактная HTML-разметка подсветки Pygments.
+
+CompactHtmlFormatter дает классы не по типу токена, а по его итоговому
+оформлению: типы с одинаковым стилем получают один короткий класс, и
+соседние токены такого стиля сливаются в один span. Токены в цвете текста
+блока выводятся без span, а пробелы внутри строки продолжают span
+предыдущего токена.
+
+Стили для этих классов дает get_style_defs() того же форматтера, поэтому
+таблица стилей собирается один раз и раздается как обычный ассет.
+plain_html() - разметка кода без подсветки, когда лексера нет.
+"""
+
+from string import ascii_lowercase
+
+from markupsafe import escape
+from pygments.formatters import HtmlFormatter
+from pygments.token import Text, Token
+from pygments.util import get_bool_opt
+
+# Оформление, которое видно и на пробелах: такие span пробелами не продлеваются
+VISIBLE_ON_SPACE = ("background", "border", "underline")
+
+
+def plain_html(code, language):
+    """Код без подсветки; экранируется, так как результат вставляется как Markup"""
+    return f'<pre><code class="language-{escape(language)}">{escape(code)}</code></pre>'
+
+
+def _short_name(index):
+    name = ""
+    while True:
+        index, rest = divmod(index, len(ascii_lowercase))
+        name = ascii_lowercase[rest] + name
+        if not index:
+            return name
+        index -= 1
+
+
+class CompactHtmlFormatter(HtmlFormatter):
+    """HtmlFormatter с короткими классами; compact=False - обычная разметка"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.compact = get_bool_opt(options, "compact", True)
+        # Цвет текста задан на самом блоке, у Text класс пустой
+        text_class = self.ttype2class.get(Text)
+        self._text_style = "" if text_class is None else self.class2style[text_class][0]
+        # Порядок class2style задан стилем, поэтому имена одинаковы в каждом процессе
+        self._short_classes = {}
+        for style, _, _ in sorted(
+            self.class2style.values(), key=lambda item: (item[2], item[1])
+        ):
+            if style != self._text_style and style not in self._short_classes:
+                self._short_classes[style] = _short_name(len(self._short_classes))
+
+    def _token_style(self, ttype):
+        return self.class2style.get(self._get_css_inline_styles(ttype), ("",))[0]
+
+    def _get_css_classes(self, ttype):
+        if not self.compact:
+            return super()._get_css_classes(ttype)
+        return self._short_classes.get(self._token_style(ttype), "")
+
+    def _merge_spaces(self, tokensource):
+        previous = Token
+        for ttype, value in tokensource:
+            if (
+                value.isspace()
+                and "\n" not in value
+                and not any(
+                    word in self._token_style(previous) for word in VISIBLE_ON_SPACE
+                )
+            ):
+                ttype = previous
+            yield ttype, value
+            # Отступ новой строки не продолжает span конца предыдущей
+            previous = Token if "\n" in value else ttype
+
+    def _format_lines(self, tokensource):
+        if self.compact:
+            tokensource = self._merge_spaces(tokensource)
+        return super()._format_lines(tokensource)
+
+    def get_linenos_style_defs(self):
+        # Без номеров строк их стили лишь добавили бы глобальное правило для pre
+        if self.compact and not self.linenos:
+            return []
+        return super().get_linenos_style_defs()
+
+    def get_token_style_defs(self, arg=None):
+        if not self.compact:
+            return super().get_token_style_defs(arg)
+        prefix = self.get_css_prefix(arg)
+        return [
+            f"{prefix(name)} {{ {style} }}"
+            for style, name in self._short_classes.items()
+        ]
@@ -0,0 +1,286 @@
+"""Неблокирующее логирование с записью пачками в фоновом потоке.
+
+setup() вешает на корневой логгер QueueHandler: поток запроса только
+кладет запись в очередь. Поток-писатель забирает все накопившиеся записи
+разом, пишет их одним проходом и сбрасывает буфер файла один раз на пачку,
+поэтому при всплеске нагрузки воркеры не ждут диск друг за другом.
+
+Файл ротируется по размеру или по времени. Ротацию из нескольких воркеров
+gunicorn сериализует flock, а остальные воркеры замечают подмену файла
+(в том числе внешним logrotate) и переоткрывают его.
+
+После fork поток-писатель не существует, поэтому очередь дописывается до
+fork, а в дочернем процессе поток запускается заново (os.register_at_fork).
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+ACCESS_LOGGER = "access"
+# Сколько записей писатель забирает из очереди за один проход
+BATCH_SIZE = 512
+
+
+class LightQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования и копирования записи в потоке запроса.
+
+    Сообщение подставляется сразу, чтобы аргументы не менялись до записи,
+    а форматирует запись уже писатель.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись; поля лога доступа берутся из record.access"""
+
+    def format(self, record):
+        data = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+        }
+        access = getattr(record, "access", None)
+        if access is not None:
+            data.update(access)
+        else:
+            data.update(
+                level=record.levelname, logger=record.name, message=record.getMessage()
+            )
+            if record.exc_text:
+                data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+def _replaced(handler):
+    """Файл обработчика удален или подменен другим процессом"""
+    try:
+        disk = os.stat(handler.baseFilename)
+    except FileNotFoundError:
+        return True
+    current = os.fstat(handler.stream.fileno())
+    return (disk.st_dev, disk.st_ino) != (current.st_dev, current.st_ino)
+
+
+def _reopen(handler):
+    handler.stream.close()
+    handler.stream = handler._open()
+    if isinstance(handler, logging.handlers.TimedRotatingFileHandler):
+        handler.rolloverAt = handler.computeRollover(int(time.time()))
+
+
+def _rollover(handler, record):
+    if not handler.shouldRollover(record):
+        return
+    if fcntl is None:
+        handler.doRollover()
+    else:
+        with open(f"{handler.baseFilename}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Пока ждали блокировку, файл мог уже ротировать другой воркер
+            if _replaced(handler):
+                _reopen(handler)
+            elif handler.shouldRollover(record):
+                handler.doRollover()
+    if handler.stream is None:
+        handler.stream = handler._open()
+
+
+class QueueWriter:
+    """Поток, переносящий записи из очереди в обработчики пачками"""
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        os.register_at_fork(
+            before=self._before_fork,
+            after_in_parent=self._after_fork_in_parent,
+            after_in_child=self._after_fork_in_child,
+        )
+        atexit.register(self.stop)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Дописывает очередь и останавливает поток"""
+        if self._thread is None:
+            return
+        self.queue.put(None)
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _take(self, first):
+        batch = [first]
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take(self.queue.get())
+            stop = None in batch
+            with self._lock:
+                self._write([record for record in batch if record is not None])
+            if stop:
+                return
+
+    def _write(self, batch):
+        for handler in self.handlers:
+            records = [
+                record
+                for record in batch
+                if record.levelno >= handler.level and handler.filter(record)
+            ]
+            if not records:
+                continue
+            with handler.lock:
+                try:
+                    self._emit(handler, records)
+                except Exception:
+                    handler.handleError(records[-1])
+
+    def _emit(self, handler, records):
+        if not isinstance(handler, logging.StreamHandler):
+            for record in records:
+                handler.emit(record)
+            return
+        rotating = isinstance(handler, logging.handlers.BaseRotatingHandler)
+        if isinstance(handler, logging.FileHandler):
+            if handler.stream is None:
+                handler.stream = handler._open()
+            elif _replaced(handler):
+                _reopen(handler)
+        parts = []
+        for record in records:
+            if rotating and handler.shouldRollover(record):
+                handler.stream.write("".join(parts))
+                parts = []
+                _rollover(handler, record)
+            parts.append(handler.format(record) + handler.terminator)
+        handler.stream.write("".join(parts))
+        handler.flush()
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not None:
+                batch.append(record)
+        if batch:
+            self._write(batch)
+
+    def _before_fork(self):
+        # Записи из очереди иначе попадут в файл и из родителя, и из потомка
+        self._lock.acquire()
+        self._drain()
+
+    def _after_fork_in_parent(self):
+        self._lock.release()
+
+    def _after_fork_in_child(self):
+        self._lock = threading.Lock()
+        self.queue = queue.SimpleQueue()
+        loggers = (logging.getLogger(), logging.getLogger(ACCESS_LOGGER))
+        for handler in (handler for logger in loggers for handler in logger.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                handler.queue = self.queue
+        if self._thread is not None:
+            self.start()
+
+
+def file_handler(
+    path, rotate_when=None, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT
+):
+    """Файловый обработчик с ротацией по времени (when) или по размеру"""
+    if rotate_when:
+        return logging.handlers.TimedRotatingFileHandler(
+            path,
+            when=rotate_when,
+            backupCount=backup_count,
+            encoding="utf-8",
+            delay=True,
+        )
+    return logging.handlers.RotatingFileHandler(
+        path,
+        maxBytes=max_bytes,
+        backupCount=backup_count,
+        encoding="utf-8",
+        delay=True,
+    )
+
+
+def setup(
+    log_dir,
+    level=logging.INFO,
+    rotate_when=None,
+    max_bytes=DEFAULT_MAX_BYTES,
+    backup_count=DEFAULT_BACKUP_COUNT,
+    access_log=None,
+):
+    """Направляет корневой логгер в async.log и консоль через фоновый поток.
+
+    С access_log лог доступа (логгер "access") пишется туда же в JSON,
+    по одной строке на запрос.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    formatter = logging.Formatter(DEFAULT_FORMAT)
+    handlers = [
+        file_handler(
+            os.path.join(log_dir, "async.log"), rotate_when, max_bytes, backup_count
+        ),
+        logging.StreamHandler(),
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        handler.addFilter(lambda record: record.name != ACCESS_LOGGER)
+
+    access_logger = logging.getLogger(ACCESS_LOGGER)
+    access_logger.propagate = False
+    access_logger.setLevel(logging.INFO if access_log else logging.CRITICAL + 1)
+    if access_log:
+        handler = file_handler(
+            os.path.join(log_dir, access_log), rotate_when, max_bytes, backup_count
+        )
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(lambda record: record.name == ACCESS_LOGGER)
+        handlers.append(handler)
+
+    writer = QueueWriter(handlers)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(LightQueueHandler(writer.queue))
+    root.setLevel(level)
+    access_logger.handlers.clear()
+    access_logger.addHandler(LightQueueHandler(writer.queue))
+    writer.start()
+    return writer
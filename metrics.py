@@ -0,0 +1,424 @@
+"""Метрики запросов в формате Prometheus и сэмплирующий профайлер.
+
+Registry хранит счетчики и гистограммы текущего процесса и раз в секунду
+сбрасывает их снимок в <directory>/<pid>.json. Запрос только дописывает
+измерение в очередь, а раскладывает их по корзинам фоновый поток. collect() складывает снимки
+всех процессов, поэтому /metrics, попавший в любой воркер gunicorn, отдает
+сумму по всему серверу. Снимки завершившихся процессов переносятся в
+<directory>/totals.json, так что счетчики не убывают после перезапуска
+воркера, даже если новый получил тот же pid.
+
+RequestTimer делит время запроса на фазы. Вложенные фазы не учитываются
+дважды: фаза получает только собственное время без вложенных.
+
+SamplingProfiler раз в interval снимает стеки потоков, обрабатывающих
+запросы, и для запросов дольше threshold дописывает их в
+<directory>/<pid>.folded в свернутом формате flamegraph.pl / speedscope.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+FLUSH_INTERVAL = 1.0
+# Сумма снимков завершившихся процессов
+TOTALS = "totals.json"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, extra=()):
+    items = [*labels, *extra]
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, snapshot):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def _add(counters, histograms, snapshot):
+    for metric, labels, value in snapshot["counters"]:
+        counters[(metric, tuple(map(tuple, labels)))] += value
+    for metric, labels, values in snapshot["histograms"]:
+        key = (metric, tuple(map(tuple, labels)))
+        if key in histograms:
+            histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+        else:
+            histograms[key] = values
+
+
+class Registry:
+    """Счетчики и гистограммы процесса со снимками в общий каталог"""
+
+    def __init__(self, directory, buckets=BUCKETS):
+        self.directory = directory
+        self.buckets = buckets
+        self.help = {}
+        self.types = {}
+        self._collectors = []
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._saved_pid = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Фоновый поток не переживает fork и мог держать блокировку
+        self._lock = threading.Lock()
+
+    def counter(self, name, description):
+        self.help[name] = description
+        self.types[name] = "counter"
+
+    def histogram(self, name, description):
+        self.help[name] = description
+        self.types[name] = "histogram"
+
+    def collector(self, func):
+        """Регистрирует функцию, возвращающую (имя, метки, значение) счетчиков"""
+        self._collectors.append(func)
+        return func
+
+    def inc(self, name, labels=(), value=1):
+        self._pending.append((False, name, labels, value))
+
+    def observe(self, name, labels, value):
+        self._pending.append((True, name, labels, value))
+
+    def _drain(self):
+        with self._lock:
+            while self._pending:
+                is_histogram, name, labels, value = self._pending.popleft()
+                key = (name, tuple(labels))
+                if not is_histogram:
+                    self._counters[key] += value
+                    continue
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    # Счетчики по корзинам, выход за последнюю и сумма значений
+                    histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+                histogram[bisect_left(self.buckets, value)] += 1
+                histogram[-1] += value
+
+    def start(self):
+        """Запускает фоновый сброс снимков; после fork - заново в дочернем процессе"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(FLUSH_INTERVAL)
+            if self._pending:
+                self.save()
+
+    def snapshot(self):
+        self._drain()
+        with self._lock:
+            counters = [
+                [name, list(labels), value]
+                for (name, labels), value in self._counters.items()
+            ]
+            histograms = [
+                [name, list(labels), list(values)]
+                for (name, labels), values in self._histograms.items()
+            ]
+        for func in self._collectors:
+            for name, labels, value in func():
+                counters.append([name, [list(label) for label in labels], value])
+        return {"counters": counters, "histograms": histograms}
+
+    def save(self):
+        pid = os.getpid()
+        path = os.path.join(self.directory, f"{pid}.json")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if self._saved_pid != pid:
+                # Снимок с нашим pid остался от завершившегося процесса
+                self._fold([pid], own=True)
+                self._saved_pid = pid
+            _write(path, self.snapshot())
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить метрики {path}: {e}")
+
+    def _fold(self, pids, own=False):
+        """Переносит снимки завершившихся процессов в totals.json"""
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            counters = defaultdict(float)
+            histograms = {}
+            totals_path = os.path.join(self.directory, TOTALS)
+            totals = _read(totals_path)
+            if totals is not None:
+                _add(counters, histograms, totals)
+            folded = []
+            for pid in pids:
+                # Под блокировкой: процесс с тем же pid мог успеть запуститься
+                if not own and _alive(pid):
+                    continue
+                path = os.path.join(self.directory, f"{pid}.json")
+                snapshot = _read(path)
+                if snapshot is not None:
+                    _add(counters, histograms, snapshot)
+                    folded.append(path)
+            if not folded:
+                return
+            _write(
+                totals_path,
+                {
+                    "counters": [
+                        [name, [list(label) for label in labels], value]
+                        for (name, labels), value in counters.items()
+                    ],
+                    "histograms": [
+                        [name, [list(label) for label in labels], values]
+                        for (name, labels), values in histograms.items()
+                    ],
+                },
+            )
+            for path in folded:
+                os.remove(path)
+
+    def reset(self):
+        """Обнуляет метрики процесса и удаляет снимки всех процессов"""
+        with self._lock:
+            self._pending.clear()
+            self._counters.clear()
+            self._histograms.clear()
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.endswith(".json"):
+                os.remove(os.path.join(self.directory, name))
+
+    def collect(self):
+        """Сумма снимков всех процессов, включая свежий снимок текущего"""
+        self.save()
+        dead = [pid for pid in self._snapshot_pids() if not _alive(pid)]
+        if dead:
+            try:
+                self._fold(dead)
+            except OSError as e:
+                logger.warning(f"Не удалось перенести снимки метрик: {e}")
+        counters = defaultdict(float)
+        histograms = {}
+        names = [TOTALS, *(f"{pid}.json" for pid in self._snapshot_pids())]
+        for name in names:
+            snapshot = _read(os.path.join(self.directory, name))
+            if snapshot is not None:
+                _add(counters, histograms, snapshot)
+        return counters, histograms
+
+    def _snapshot_pids(self):
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            return []
+        return [
+            int(name.removesuffix(".json"))
+            for name in names
+            if name.removesuffix(".json").isdigit() and name.endswith(".json")
+        ]
+
+    def render(self):
+        """Текстовый формат Prometheus 0.0.4"""
+        counters, histograms = self.collect()
+        series = defaultdict(list)
+        for (name, labels), value in sorted(counters.items()):
+            series[name].append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), values in sorted(histograms.items()):
+            total = 0
+            for bound, count in zip((*self.buckets, float("inf")), values):
+                total += count
+                series[name].append(
+                    f"{name}_bucket{_labels(labels, [('le', _number(bound))])} {total}"
+                )
+            series[name].append(f"{name}_sum{_labels(labels)} {_number(values[-1])}")
+            series[name].append(f"{name}_count{_labels(labels)} {total}")
+        lines = []
+        for name in sorted(series):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {self.types[name]}")
+            lines.extend(series[name])
+        return "\n".join(lines) + "\n"
+
+
+class RequestTimer:
+    """Собственное время фаз одного запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)
+        self._stack = []
+
+    def push(self, name):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def pop(self):
+        name, started, nested = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.phases[name] += elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    @contextmanager
+    def phase(self, name):
+        self.push(name)
+        try:
+            yield
+        finally:
+            self.pop()
+
+    def unwind(self, name):
+        """Закрывает фазы name, оставшиеся на вершине стека после исключения"""
+        while self._stack and self._stack[-1][0] == name:
+            self.pop()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+
+
+class SamplingProfiler:
+    """Сэмплирующий профайлер медленных запросов"""
+
+    def __init__(self, directory, interval, threshold):
+        self.directory = directory
+        self.interval = interval
+        self.threshold = threshold
+        self._active = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._active = {}
+        threading.Thread(target=self._sample_loop, daemon=True).start()
+
+    def _sample_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            stacks = []
+            for ident, samples in active:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                if stack:
+                    stacks.append((ident, samples, ";".join(reversed(stack))))
+            # Под блокировкой: end() мог уже забрать Counter и писать его в файл
+            with self._lock:
+                for ident, samples, stack in stacks:
+                    if self._active.get(ident) is samples:
+                        samples[stack] += 1
+
+    def begin(self):
+        """Начинает сбор стеков текущего потока"""
+        with self._lock:
+            self._start()
+            self._active[threading.get_ident()] = Counter()
+
+    def end(self, ident, name, duration):
+        """Завершает сбор и сохраняет стеки, если запрос был медленным"""
+        with self._lock:
+            samples = self._active.pop(ident, None)
+        if not samples or duration < self.threshold:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.folded")
+        prefix = name.replace(";", ":").replace(" ", "_")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.writelines(
+                    f"{prefix};{stack} {count}\n" for stack, count in samples.items()
+                )
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить профиль {path}: {e}")
+            return
+        logger.warning(
+            f"Медленный запрос {name}: {duration * 1000:.1f} мс, "
+            f"{sum(samples.values())} сэмплов в {path}"
+        )
@@ -0,0 +1,92 @@
+"""Граф страниц сайта.
+
+Каждая страница - узел (путь, шаблон, контекст), собранный из контента
+заранее. Маршрут описывает правило URL и функцию, перечисляющую его
+страницы; правила регистрируются в приложении из графа один раз, а запрос
+только находит готовый узел по пути.
+
+Граф перестраивается целиком, когда меняется версия контента, поэтому
+новый язык или проект получает страницы без изменения маршрутов.
+"""
+
+import threading
+from urllib.parse import unquote
+from dataclasses import dataclass
+from typing import Any, Callable
+
+
+@dataclass(frozen=True, slots=True)
+class Route:
+    rule: str
+    endpoint: str
+    template: str
+    expand: Callable
+    stream: bool
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class Page:
+    path: str
+    endpoint: str
+    template: str
+    context: dict
+    # Данные, от которых зависит страница: по ним экспорт решает, перерисовывать ли ее
+    data: Any
+    stream: bool
+
+
+class PageGraph:
+    """Все страницы сайта, построенные из контента версии version()"""
+
+    def __init__(self, app, version):
+        self.app = app
+        self.version = version
+        self.routes = []
+        self._pages = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def route(self, rule, template, stream=False):
+        """Декоратор функции, перечисляющей страницы правила.
+
+        Функция возвращает тройки (аргументы URL, контекст шаблона, данные
+        страницы); ее имя становится endpoint для url_for.
+        """
+
+        def decorator(func):
+            self.routes.append(Route(rule, func.__name__, template, func, stream))
+            return func
+
+        return decorator
+
+    def register(self, view):
+        """Регистрирует правила всех маршрутов с общим view"""
+        for route in self.routes:
+            self.app.add_url_rule(route.rule, route.endpoint, view)
+
+    def _build(self):
+        adapter = self.app.url_map.bind("localhost")
+        pages = {}
+        for route in self.routes:
+            for values, context, data in route.expand():
+                # Ключ - путь в виде request.path, то есть без %-кодирования
+                path = unquote(adapter.build(route.endpoint, values))
+                pages[path] = Page(
+                    path, route.endpoint, route.template, context, data, route.stream
+                )
+        return pages
+
+    def pages(self):
+        version = self.version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._pages = self._build()
+                    self._version = version
+        return self._pages
+
+    def get(self, path):
+        return self.pages().get(path)
+
+    def __iter__(self):
+        return iter(self.pages().values())
@@ -1,412 +1,1162 @@
+import argparse
+import gzip
 import hashlib
 import json
 import logging
+import mimetypes
 import os
+import re
+import shutil
+import sys
+import threading
+import time
+import types
+import unicodedata
+import zlib
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import lru_cache, wraps
 
-from flask import Flask, render_template
+import pygments
+from flask import (
+    Flask,
+    Response,
+    abort,
+    before_render_template,
+    g,
+    has_request_context,
+    render_template,
+    request,
+    send_from_directory,
+    stream_with_context,
+    template_rendered,
+    url_for,
+)
 from flask_caching import Cache
+from markupsafe import Markup
 from pygments import highlight
-from pygments.formatters import HtmlFormatter
 from pygments.lexers import CrystalLexer, PythonLexer, RustLexer, get_lexer_by_name
 from pygments.util import ClassNotFound
+from werkzeug.security import safe_join
+
+import assets
+import highlighting
+import logs
+import metrics
+import pages
+from cache_backends import instance_name, private_dir
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 
 
-log_dir = "/root/logs"
-os.makedirs(log_dir, exist_ok=True)
+log_dir = os.environ.get("LOG_DIR", "/root/logs")
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler(os.path.join(log_dir, "async.log"), encoding="utf-8"),
-        logging.StreamHandler(),
-    ],
+# Файлы ротируются по времени, если задан LOG_ROTATE_WHEN (например,
+# midnight), иначе по размеру; ACCESS_LOG_JSON - имя файла JSON-лога доступа
+log_writer = logs.setup(
+    log_dir,
+    rotate_when=os.environ.get("LOG_ROTATE_WHEN"),
+    max_bytes=int(os.environ.get("LOG_MAX_BYTES", logs.DEFAULT_MAX_BYTES)),
+    backup_count=int(os.environ.get("LOG_BACKUP_COUNT", logs.DEFAULT_BACKUP_COUNT)),
+    access_log=os.environ.get("ACCESS_LOG_JSON"),
 )
 logger = logging.getLogger(__name__)
-app.logger.addHandler(
-    logging.FileHandler(os.path.join(log_dir, "async.log"), encoding="utf-8")
-)
-app.logger.setLevel(logging.INFO)
+access_logger = logging.getLogger(logs.ACCESS_LOGGER)
 
-app.config["CACHE_TYPE"] = "simple"
+app.config["CACHE_TYPE"] = os.environ.get(
+    "CACHE_TYPE", "cache_backends.SharedMemoryCache"
+)
 app.config["CACHE_DEFAULT_TIMEOUT"] = 3600
+app.config["CACHE_MAX_BYTES"] = 64 * 1024 * 1024
+for name in ("CACHE_SHM_PATH", "CACHE_REDIS_URL", "CACHE_KEY_PREFIX"):
+    if name in os.environ:
+        app.config[name] = os.environ[name]
+# Версия контента входит в ключ страницы, поэтому страницы живут до вытеснения
+app.config["PAGE_CACHE_TIMEOUT"] = 0
 cache = Cache(app)
 
 
-def highlight_code(code, language):
-    try:
-        if language == "crystal":
-            lexer = CrystalLexer()
-        elif language == "rust":
-            lexer = RustLexer()
-        elif language == "python":
-            lexer = PythonLexer()
-        else:
-            lexer = get_lexer_by_name(language)
-
-        formatter = HtmlFormatter(
-            style="monokai", cssclass="highlight", linenos=False, wrapcode=True
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def release_digest():
+    """Хеш кода и шаблонов: страницы в общем кеше не переживают деплой"""
+    digest = hashlib.sha256()
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    for root, _, files in sorted(os.walk(template_dir)):
+        for name in sorted(files):
+            with open(os.path.join(root, name), "rb") as f:
+                digest.update(f.read())
+    for path in (__file__, highlighting.__file__, pages.__file__):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+RELEASE = release_digest()
+
+SITE_NAME = "async.pw"
+
+HIGHLIGHT_OPTIONS = {
+    "style": "monokai",
+    "cssclass": "highlight",
+    "linenos": False,
+    "wrapcode": True,
+    "compact": True,
+}
+# Подсветка пересчитывается при обновлении Pygments или смене разметки
+HIGHLIGHT_VERSION = [pygments.__version__, file_digest(highlighting.__file__)[:12]]
+# Стили подсветки, собираемые в хешированный ассет из того же форматтера
+HIGHLIGHT_CSS = "css/highlight.css"
+HIGHLIGHT_STORE_PATH = os.path.join(app.instance_path, "highlight.json")
+
+CONTENT_DIR = os.path.join(app.root_path, "content")
+CONTENT_RELOAD_INTERVAL = 2.0
+
+ASSET_DIR = "dist"
+ASSET_MAX_AGE = 365 * 24 * 3600
+COMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Метка flush() в потоковом рендере: на ней накопленный HTML уходит клиенту
+FLUSH_MARKER = "\x1e"
+# Поток сжимается по кускам, поэтому уровни ниже, чем у страниц в кеше
+STREAM_BROTLI_QUALITY = 5
+STREAM_GZIP_LEVEL = 6
+
+# Снимки метрик воркеров, из которых /metrics собирает сумму по серверу
+METRICS_DIR = os.environ.get("METRICS_DIR") or os.path.join(
+    private_dir("async-pw"), f"metrics-{instance_name(app.instance_path)}"
+)
+# Профайлер включается порогом медленного запроса в миллисекундах
+PROFILE_SLOW_MS = os.environ.get("PROFILE_SLOW_MS")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.environ.get(
+    "PROFILE_DIR", os.path.join(app.instance_path, "profiles")
+)
+# Стили, встраиваемые в <head>: шрифты и иконки целиком, из styles.css -
+# только правила первого экрана
+CRITICAL_INLINE = ("vendor/fonts.css", "vendor/devicon.css")
+CRITICAL_SELECTORS = {
+    "css/styles.css": (
+        "*",
+        ":root",
+        "html",
+        "body",
+        "h1",
+        "p",
+        "a",
+        ".navbar",
+        ".nav-",
+        ".prompt",
+        ".container",
+        ".content",
+        ".sidebar",
+        ".language-icon",
+        ".devicon-",
+    )
+}
+
+asset_manifest = assets.Manifest(os.path.join(app.static_folder, ASSET_DIR))
+
+
+def build_assets(force=True):
+    """Собирает статику; с force=False - только если исходники изменились"""
+    generated = {HIGHLIGHT_CSS: highlight_css()}
+    digest = assets.source_digest(
+        app.static_folder,
+        asset_manifest.output_dir,
+        generated=generated,
+        config=[CRITICAL_INLINE, CRITICAL_SELECTORS],
+    )
+    if not force and asset_manifest.sources == digest:
+        return
+    manifest = assets.build(
+        app.static_folder, asset_manifest.output_dir, generated=generated
+    )
+    assets.write_critical_css(
+        asset_manifest.output_dir,
+        manifest,
+        f"{app.static_url_path}/{ASSET_DIR}/",
+        CRITICAL_INLINE,
+        CRITICAL_SELECTORS,
+    )
+    assets.save_source_digest(asset_manifest.output_dir, digest)
+    asset_manifest.load()
+
+
+def fetch_vendor():
+    """Готовит урезанные devicon и JetBrains Mono под текущие шаблоны и контент"""
+    icons = {"github-original"}
+    text = []
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    for root, _, files in os.walk(template_dir):
+        for name in files:
+            with open(os.path.join(root, name), encoding="utf-8") as f:
+                source = f.read()
+            icons.update(re.findall(r"devicon-([a-z0-9]+-[a-z0-9-]+)", source))
+            text.append(source)
+    for language in content.all():
+        icons.add(f"{language.icon}-plain")
+        with open(os.path.join(CONTENT_DIR, f"{language.slug}.json"), encoding="utf-8") as f:
+            text.append(f.read())
+    assets.fetch_vendor(
+        app.static_folder,
+        os.path.join(app.instance_path, "vendor"),
+        icons,
+        "".join(text),
+    )
+
+
+@app.context_processor
+def asset_context():
+    return {
+        "critical_css": Markup(asset_manifest.critical_css),
+        "vendored": asset_manifest.get("vendor/devicon.css") is not None,
+        # Без собранных ассетов стили подсветки встраиваются в страницу
+        "highlight_css": (
+            None if asset_manifest.get(HIGHLIGHT_CSS) else Markup(highlight_css())
+        ),
+    }
+
+
+app.jinja_env.globals["site_name"] = SITE_NAME
+
+
+@app.template_global()
+def flush():
+    """Точка отправки накопленного HTML при потоковом рендере, иначе пусто"""
+    return FLUSH_MARKER if g.get("streaming") else ""
+
+
+@app.url_defaults
+def hashed_static_url(endpoint, values):
+    """url_for('static', ...) ведет на хешированный файл из манифеста"""
+    if endpoint == "static":
+        hashed = asset_manifest.get(values.get("filename"))
+        if hashed:
+            values["filename"] = f"{ASSET_DIR}/{hashed}"
+
+
+def static_asset(filename):
+    """Статика; ассеты из dist предсжаты, хешированные - с immutable-кешем"""
+    if not filename.startswith(f"{ASSET_DIR}/"):
+        return app.send_static_file(filename)
+    path = safe_join(app.static_folder, filename)
+    if path is None:
+        abort(404)
+    encoding = request.accept_encodings.best_match(
+        [
+            name
+            for name, suffix in COMPRESSED_SUFFIXES.items()
+            if os.path.isfile(path + suffix)
+        ]
+    )
+    # manifest.json, critical.css и sources.txt меняются без смены имени
+    hashed = filename.removeprefix(f"{ASSET_DIR}/") in asset_manifest.hashed
+    response = send_from_directory(
+        app.static_folder,
+        filename + COMPRESSED_SUFFIXES.get(encoding, ""),
+        mimetype=mimetypes.guess_type(filename)[0],
+        download_name=os.path.basename(filename),
+        max_age=ASSET_MAX_AGE if hashed else None,
+    )
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add("Accept-Encoding")
+    if hashed:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+
+app.view_functions["static"] = static_asset
+
+
+registry = metrics.Registry(METRICS_DIR)
+registry.histogram("http_request_duration_seconds", "Полное время обработки запроса")
+registry.histogram(
+    "http_request_phase_seconds",
+    "Собственное время фаз запроса: lookup, highlight, render, compress, "
+    "cache, write, other",
+)
+registry.counter("page_cache_requests_total", "Обращения к кешу страниц")
+registry.counter("cache_backend_requests_total", "Обращения к бэкенду кеша")
+
+profiler = None
+if PROFILE_SLOW_MS:
+    profiler = metrics.SamplingProfiler(
+        PROFILE_DIR, PROFILE_INTERVAL_MS / 1000, float(PROFILE_SLOW_MS) / 1000
+    )
+
+
+@registry.collector
+def cache_backend_stats():
+    backend = cache.cache
+    if not hasattr(backend, "stats"):
+        return []
+    name = type(backend).__name__
+    return [
+        ("cache_backend_requests_total", (("backend", name), ("result", result)), value)
+        for result, value in (("hit", backend.hits), ("miss", backend.misses))
+    ]
+
+
+def phase(name):
+    """Учитывает блок как фазу текущего запроса"""
+    timer = g.get("timer") if has_request_context() else None
+    return timer.phase(name) if timer is not None else nullcontext()
+
+
+def request_route():
+    return request.url_rule.rule if request.url_rule else "<unmatched>"
+
+
+@app.before_request
+def start_timer():
+    registry.start()
+    g.timer = metrics.RequestTimer()
+    if profiler is not None:
+        profiler.begin()
+
+
+@before_render_template.connect_via(app)
+def start_render(sender, template, context, **extra):
+    if g.get("timer") is not None:
+        g.timer.push("render")
+
+
+@template_rendered.connect_via(app)
+def stop_render(sender, template, context, **extra):
+    if g.get("timer") is not None:
+        g.timer.pop()
+
+
+@app.after_request
+def record_request(response):
+    """Записывает метрики запроса, когда ответ полностью отправлен"""
+    timer = g.get("timer")
+    if timer is None:
+        return response
+    route = request_route()
+    method = request.method
+    status = str(response.status_code)
+    ident = threading.get_ident()
+    access = None
+    if access_logger.isEnabledFor(logging.INFO):
+        access = {
+            "method": method,
+            "path": request.path,
+            "route": route,
+            "status": response.status_code,
+            "bytes": response.content_length,
+            "remote": request.remote_addr,
+            "agent": request.user_agent.string,
+        }
+    # Шаблон, упавший с исключением, не вызвал template_rendered
+    timer.unwind("render")
+    timer.push("write")
+
+    def finish():
+        timer.pop()
+        duration = timer.elapsed()
+        timer.phases["other"] = max(duration - sum(timer.phases.values()), 0.0)
+        registry.observe(
+            "http_request_duration_seconds",
+            (("route", route), ("method", method), ("status", status)),
+            duration,
         )
+        for name, seconds in timer.phases.items():
+            registry.observe(
+                "http_request_phase_seconds", (("route", route), ("phase", name)), seconds
+            )
+        if profiler is not None:
+            profiler.end(ident, f"{method} {route}", duration)
+        if access is not None:
+            access["duration_ms"] = round(duration * 1000, 3)
+            access_logger.info("", extra={"access": access})
+
+    if response.direct_passthrough:
+        # Файл статики отдается напрямую, и close() ответа не вызывается
+        finish()
+    else:
+        response.call_on_close(finish)
+    return response
+
+
+highlight_formatter = highlighting.CompactHtmlFormatter(**HIGHLIGHT_OPTIONS)
+LEXERS = {"crystal": CrystalLexer, "rust": RustLexer, "python": PythonLexer}
+lexers = {}
+
+
+@lru_cache(maxsize=None)
+def highlight_css():
+    """Стили подсветки; форматтер не меняется, поэтому собираются один раз"""
+    return highlight_formatter.get_style_defs(f".{HIGHLIGHT_OPTIONS['cssclass']}")
 
-        highlighted = highlight(code, lexer, formatter)
-        return highlighted
+
+def get_lexer(language):
+    """Лексер языка; экземпляры переиспользуются между вызовами"""
+    lexer = lexers.get(language)
+    if lexer is None:
+        lexer_class = LEXERS.get(language)
+        lexer = lexers[language] = (
+            lexer_class() if lexer_class else get_lexer_by_name(language)
+        )
+    return lexer
+
+
+def highlight_code(code, language):
+    try:
+        return highlight(code, get_lexer(language), highlight_formatter)
     except ClassNotFound:
-        return f'<pre><code class="language-{language}">{code}</code></pre>'
+        return highlighting.plain_html(code, language)
     except Exception as e:
-        print(f"Ошибка подсветки: {e}")
-        return f'<pre><code class="language-{language}">{code}</code></pre>'
+        logger.error(f"Ошибка подсветки: {e}")
+        return highlighting.plain_html(code, language)
 
 
-LANGUAGES = [
-    {
-        "name": "Crystal",
-        "slug": "crystal",
-        "description": "Современный компилируемый язык программирования с синтаксисом Ruby.",
-        "features": [
-            {
-                "title": "Статическая типизация",
-                "description": "Crystal использует статическую типизацию для обеспечения безопасности типов на этапе компиляции. Это позволяет выявлять ошибки до выполнения программы и обеспечивает лучшую производительность.",
-            },
-            {
-                "title": "Производительность C",
-                "description": "Благодаря компиляции в нативный код, Crystal достигает производительности, сравнимой с C. Это делает его идеальным для высоконагруженных приложений и системного программирования.",
-            },
-            {
-                "title": "Синтаксис Ruby",
-                "description": "Crystal наследует элегантный и выразительный синтаксис Ruby, что делает код читаемым и приятным для написания. Разработчики Ruby могут легко перейти на Crystal.",
-            },
-            {
-                "title": "Автоматическое управление памятью",
-                "description": "Crystal использует сборщик мусора для автоматического управления памятью, что избавляет разработчиков от ручного управления памятью и предотвращает утечки памяти.",
-            },
-            {
-                "title": "Макросы и метапрограммирование",
-                "description": "Мощная система макросов позволяет генерировать код во время компиляции, что обеспечивает гибкость и производительность. Это особенно полезно для создания DSL и оптимизации кода.",
-            },
-        ],
-        "history": {
-            "creator": "Ари Борер (Ary Borenszweig)",
-            "creator_wiki": "https://en.wikipedia.org/wiki/Ary_Borenszweig",
-            "year": "2011",
-            "inspiration": "Ruby, C, Go",
-            "development": "Crystal был создан как попытка объединить элегантность Ruby с производительностью C. Первая версия 0.1.0 вышла в 2014 году. Язык развивался медленно, но стабильно, достигнув версии 1.0 в 2021 году. Разработка велась небольшой командой энтузиастов, которые стремились создать язык, который был бы так же приятен для написания, как Ruby, но компилировался в быстрый нативный код. Ключевыми особенностями стали статическая типизация, вывод типов и мощная система макросов. Язык прошел через множество итераций, включая изменения в синтаксисе и системе типов.",
-            "impact": "Crystal повлиял на развитие других языков, показав, что можно совместить высокоуровневый синтаксис с низкоуровневой производительностью. Вдохновил создание похожих языков в других экосистемах.",
-            "future": "Язык продолжает развиваться, фокусируясь на веб-разработке и системном программировании. Планируется улучшение производительности компилятора и расширение экосистемы.",
-        },
-        "projects": [
-            {
-                "name": "Lucky Framework",
-                "description": "Полнофункциональный веб-фреймворк для Crystal, вдохновленный Ruby on Rails. Lucky предоставляет мощные генераторы кода, встроенную ORM с миграциями, автоматическую валидацию данных, систему маршрутизации и middleware. Фреймворк фокусируется на type safety и производительности, предлагая compile-time проверки и быструю разработку. Включает в себя встроенную поддержку WebSockets, фоновых задач, кеширования и тестирования. Lucky идеально подходит для создания масштабируемых веб-приложений с акцентом на безопасность типов и developer experience.",
-                "github": "https://github.com/luckyframework/lucky",
-                "code_example": """
-class Users::Index < BrowserAction
-  get "/users" do
-    users = UserQuery.new
-    render IndexPage, users: users
-  end
-end""",
-            },
-            {
-                "name": "Kemal",
-                "description": "Быстрый, эффективный и простой веб-фреймворк для Crystal, вдохновленный Sinatra и Express.js. Kemal предоставляет минималистичный подход к веб-разработке с фокусом на производительность и простоту использования. Фреймворк поддерживает middleware, WebSockets, статические файлы, CORS, сессии и cookies. Благодаря компиляции в нативный код, Kemal показывает отличную производительность и низкое потребление памяти. Идеально подходит для создания API, микросервисов, real-time приложений и простых веб-сайтов с высокой нагрузкой.",
-                "github": "https://github.com/kemalcr/kemal",
-                "code_example": """
-require "kemal"
-
-get "/" do
-  "Hello World!"
-end
-
-Kemal.run""",
-            },
-            {
-                "name": "Crystal HTTP",
-                "description": "Мощный HTTP клиент для Crystal с поддержкой HTTP/1.1, HTTP/2, WebSockets и множества других возможностей. Библиотека предоставляет синхронный и асинхронный API, поддержку SSL/TLS, автоматическое сжатие, cookies, редиректы и таймауты. Crystal HTTP используется для создания API клиентов, веб-скрапинга, интеграции с внешними сервисами и построения микросервисов. Библиотека оптимизирована для производительности и предоставляет удобный API для работы с HTTP протоколом в Crystal приложениях.",
-                "github": "https://github.com/crystal-lang/crystal",
-                "code_example": """
-require "http/client"
-
-client = HTTP::Client.new("https://api.example.com")
-response = client.get("/users")
-puts response.body""",
-            },
-            {
-                "name": "Amber Framework",
-                "description": "Полнофункциональный веб-фреймворк для Crystal, предоставляющий генераторы, ORM, маршрутизацию, middleware и многое другое. Amber вдохновлен Ruby on Rails и предоставляет аналогичную структуру проекта с контроллерами, моделями, представлениями и маршрутами. Фреймворк включает в себя встроенную ORM с миграциями, систему аутентификации, поддержку WebSockets, фоновых задач и кеширования. Amber идеально подходит для разработки масштабируемых веб-приложений с акцентом на производительность и developer experience.",
-                "github": "https://github.com/amberframework/amber",
-                "code_example": """
-class UsersController < ApplicationController
-  def index
-    users = User.all
-    render("index.slang")
-  end
-end""",
-            },
-        ],
-        "icon": "crystal",
-    },
+class HighlightStore:
+    """Хранилище подсвеченного кода с ключом по хешу содержимого.
+
+    Новые записи сохраняются на диск, поэтому при перезапуске Pygments
+    не вызывается вовсе.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._items = None
+        self._dirty = False
+
+    @staticmethod
+    def key(code, language):
+        payload = json.dumps(
+            [code, language, HIGHLIGHT_OPTIONS, HIGHLIGHT_VERSION],
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        # Префикс языка нужен, чтобы чистить записи еще не загруженных языков
+        return f"{language}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    def get(self, code, language):
+        if self._items is None:
+            self.load()
+        key = self.key(code, language)
+        html = self._items.get(key)
+        if html is None:
+            with phase("highlight"):
+                html = self._items[key] = highlight_code(code, language)
+            self._dirty = True
+        return html
+
+    def load(self):
+        items = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать кеш подсветки {self.path}: {e}")
+        self._items = items
+
+    def prune(self, languages, slugs):
+        """Удаляет записи, не используемые загруженными языками, и записи
+        языков, которых больше нет среди slugs"""
+        if self._items is None:
+            return
+        used = {
+            self.key(project.code_example, language.slug)
+            for language in languages
+            for project in language.projects
+            if project.code_example
+        }
+        loaded = {language.slug for language in languages}
+        for key in list(self._items):
+            slug = key.partition(":")[0]
+            if slug in loaded and key not in used or slug not in slugs:
+                del self._items[key]
+                self._dirty = True
+
+    def flush(self):
+        """Сохраняет кеш на диск, если в нем появились новые или удаленные записи"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._items, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кеш подсветки {self.path}: {e}")
+
+
+highlight_store = HighlightStore(HIGHLIGHT_STORE_PATH)
+
+
+@dataclass(frozen=True, slots=True)
+class Feature:
+    title: str
+    description: str
+
+
+@dataclass(frozen=True, slots=True)
+class History:
+    creator: str
+    creator_wiki: str
+    year: str
+    inspiration: str
+    development: str
+    impact: str
+    future: str
+
+
+@dataclass(frozen=True, slots=True)
+class Project:
+    name: str
+    description: str
+    github: str
+    code_example: str
+    code_html: Markup
+    anchor: str
+
+
+@dataclass(frozen=True, slots=True)
+class Language:
+    name: str
+    slug: str
+    order: int
+    description: str
+    icon: str
+    features: tuple[Feature, ...]
+    history: History
+    projects: tuple[Project, ...]
+    digest: str
+
+
+TRANSLIT = str.maketrans(
     {
-        "name": "Rust",
-        "slug": "rust",
-        "description": "Системный язык программирования с фокусом на безопасность и производительность.",
-        "features": [
-            {
-                "title": "Безопасность памяти без сборщика мусора",
-                "description": "Rust гарантирует безопасность памяти через систему владения и заимствования, исключая целый класс ошибок (null pointer, use-after-free, data races) без использования сборщика мусора.",
-            },
-            {
-                "title": "Высокая производительность",
-                "description": "Rust компилируется в эффективный машинный код с нулевой стоимостью абстракций. Производительность сравнима с C/C++, но с дополнительными гарантиями безопасности.",
-            },
-            {
-                "title": "Параллельное программирование",
-                "description": "Rust делает параллельное программирование безопасным через систему владения. Невозможно создать data races, что упрощает написание многопоточных приложений.",
-            },
-            {
-                "title": "Система владения",
-                "description": "Уникальная система владения Rust обеспечивает автоматическое управление памятью без сборщика мусора. Каждое значение имеет единственного владельца, что предотвращает утечки памяти.",
-            },
-            {
-                "title": "Макросы и метапрограммирование",
-                "description": "Процедурные макросы позволяют генерировать код во время компиляции, создавая мощные абстракции и DSL. Это обеспечивает гибкость без потери производительности.",
-            },
-        ],
-        "history": {
-            "creator": "Грейдон Хоар (Graydon Hoare)",
-            "creator_wiki": "https://en.wikipedia.org/wiki/Graydon_Hoare",
-            "year": "2006",
-            "inspiration": "C++, ML, Haskell, Erlang",
-            "development": "Rust начал разрабатываться в Mozilla как альтернатива C++. Первая версия 0.1 вышла в 2012 году. Язык прошел через множество итераций, включая кардинальные изменения в синтаксисе. Стабильная версия 1.0 была выпущена в 2015 году. Разработка велась под руководством Mozilla Research, с участием большого сообщества разработчиков. Ключевыми инновациями стали система владения (ownership), заимствование (borrowing) и lifetimes. Язык прошел через несколько major breaking changes, включая изменения в синтаксисе макросов и системы модулей.",
-            "impact": "Rust революционизировал системное программирование, доказав, что можно достичь безопасности памяти без сборщика мусора. Используется в критически важных системах: браузеры, операционные системы, блокчейн.",
-            "future": "Rust продолжает расти в популярности, особенно в области веб-разработки, благодаря фреймворкам как Actix и Rocket. Планируется улучшение ergonomics и расширение экосистемы.",
-        },
-        "projects": [
-            {
-                "name": "Tokio",
-                "description": "Асинхронная среда выполнения для Rust, предоставляющая высокопроизводительные примитивы для создания сетевых приложений. Tokio включает в себя асинхронный runtime, TCP/UDP сокеты, таймеры, файловый I/O, синхронизацию и многое другое. Библиотека построена на основе epoll, kqueue и IOCP для максимальной производительности на разных платформах. Tokio используется в production системах для создания высоконагруженных серверов, микросервисов, real-time приложений и сетевых протоколов. Предоставляет удобный API для работы с асинхронным кодом и является основой для многих других Rust библиотек.",
-                "github": "https://github.com/tokio-rs/tokio",
-                "code_example": """// Асинхронный HTTP сервер
-use tokio::net::TcpListener;
-
-#[tokio::main]
-async fn main() -> Result<(), Box<dyn std::error::Error>> {
-    let listener = TcpListener::bind("127.0.0.1:8080").await?;
-    loop {
-        let (socket, _) = listener.accept().await?;
-        tokio::spawn(async move {
-            // Обработка соединения
-        });
+        **dict(zip("абвгдезийклмнопрстуфыэ", "abvgdezijklmnoprstufye")),
+        **{"ё": "e", "ж": "zh", "х": "h", "ц": "c", "ч": "ch", "ш": "sh"},
+        **{"щ": "sch", "ъ": "", "ь": "", "ю": "yu", "я": "ya"},
     }
-}""",
-            },
-            {
-                "name": "Serde",
-                "description": "Мощный фреймворк для сериализации и десериализации данных в Rust с поддержкой множества форматов. Serde поддерживает JSON, YAML, TOML, MessagePack, BSON, XML и многие другие форматы с высокой производительностью и безопасностью типов. Библиотека использует derive макросы для автоматической генерации кода сериализации, обеспечивая compile-time проверки и оптимизации. Serde широко используется в экосистеме Rust для работы с конфигурационными файлами, API, базами данных и межязыкового взаимодействия. Предоставляет гибкий API для кастомизации процесса сериализации.",
-                "github": "https://github.com/serde-rs/serde",
-                "code_example": """// Сериализация JSON
-use serde::{Deserialize, Serialize};
-
-#[derive(Serialize, Deserialize)]
-struct User {
-    name: String,
-    age: u32,
-}
+)
 
-let user = User { name: "Alice".to_string(), age: 30 };
-let json = serde_json::to_string(&user)?;""",
-            },
-            {
-                "name": "Actix Web",
-                "description": "Один из самых быстрых и мощных веб-фреймворков для Rust, основанный на actor model и асинхронном программировании. Actix Web предоставляет высокопроизводительный HTTP сервер с поддержкой WebSockets, middleware, маршрутизации, валидации данных и аутентификации. Фреймворк оптимизирован для создания высоконагруженных API, микросервисов и real-time приложений. Включает в себя встроенную поддержку CORS, сжатия, логирования, метрик и тестирования. Actix Web используется в production для создания масштабируемых веб-сервисов с акцентом на производительность и безопасность.",
-                "github": "https://github.com/actix/actix-web",
-                "code_example": """// Веб-API с Actix
-use actix_web::{web, App, HttpServer, Result};
-
-async fn index() -> Result<&'static str> {
-    Ok("Hello World!")
-}
 
-#[actix_web::main]
-async fn main() -> std::io::Result<()> {
-    HttpServer::new(|| App::new().route("/", web::get().to(index)))
-        .bind("127.0.0.1:8080")?
-        .run()
-        .await
-}""",
-            },
-            {
-                "name": "Rust Analyzer",
-                "description": "Языковой сервер для Rust, предоставляющий мощные возможности для разработки в IDE. Rust Analyzer включает в себя автодополнение кода, рефакторинг, анализ ошибок, навигацию по коду, поиск определений и ссылок, форматирование кода и многое другое. Инструмент использует статический анализ для предоставления точных подсказок и проверок в реальном времени. Rust Analyzer критически важен для эффективной разработки на Rust, значительно улучшая developer experience и продуктивность. Поддерживается всеми популярными редакторами и IDE через Language Server Protocol.",
-                "github": "https://github.com/rust-lang/rust-analyzer",
-                "code_example": """// Rust Analyzer LSP
-// Автоматически предоставляет:
-// - Автодополнение
-// - Рефакторинг
-// - Анализ ошибок
-// - Навигация по коду""",
-            },
-        ],
-        "icon": "rust",
-    },
-    {
-        "name": "Python",
-        "slug": "python",
-        "description": "Высокоуровневый язык программирования общего назначения с акцентом на читаемость кода.",
-        "features": [
-            {
-                "title": "Простой и читаемый синтаксис",
-                "description": 'Python использует отступы для группировки кода, что делает его очень читаемым. Философия "красивое лучше уродливого" делает код понятным даже для новичков.',
-            },
-            {
-                "title": "Большая стандартная библиотека",
-                "description": "Python поставляется с обширной стандартной библиотекой, включающей модули для работы с файлами, сетью, регулярными выражениями, XML, JSON и многим другим.",
-            },
-            {
-                "title": "Кроссплатформенность",
-                "description": "Python работает на всех основных операционных системах (Windows, macOS, Linux) без изменений в коде. Это обеспечивает переносимость приложений между платформами.",
-            },
-            {
-                "title": "Динамическая типизация",
-                "description": "Python использует динамическую типизацию, что делает его гибким и быстрым для прототипирования. Типы определяются во время выполнения, что упрощает разработку.",
-            },
-            {
-                "title": "Активное сообщество",
-                "description": "Python имеет огромное и активное сообщество разработчиков, которое создает библиотеки для любых задач: веб-разработка, анализ данных, машинное обучение, автоматизация.",
-            },
-        ],
-        "history": {
-            "creator": "Гвидо ван Россум (Guido van Rossum)",
-            "creator_wiki": "https://en.wikipedia.org/wiki/Guido_van_Rossum",
-            "year": "1991",
-            "inspiration": "ABC, Modula-3, C, Java",
-            "development": 'Python был создан как хобби-проект Гвидо ван Россума во время рождественских каникул 1989 года. Первая версия 0.9.0 вышла в 1991 году. Python 2.0 (2000) и Python 3.0 (2008) стали ключевыми вехами в развитии языка. Разработка велась под руководством "Benevolent Dictator For Life" (BDFL) Гвидо ван Россума до 2018 года. Ключевыми принципами стали "красивое лучше уродливого" и "простота лучше сложности". Язык прошел через множество итераций, включая добавление декораторов, генераторов и type hints.',
-            "impact": "Python стал одним из самых популярных языков программирования, особенно в области науки о данных, машинного обучения и веб-разработки. Используется в Google, Facebook, Netflix, Instagram.",
-            "future": "Python продолжает доминировать в области ИИ и машинного обучения. Развивается в направлении повышения производительности (PyPy, Cython) и улучшения типизации (type hints).",
-        },
-        "projects": [
-            {
-                "name": "Django",
-                "description": 'Высокоуровневый веб-фреймворк для Python, который поощряет быструю разработку и чистый, прагматичный дизайн. Django следует принципу "batteries included" и предоставляет встроенную ORM, систему аутентификации, админ-панель, маршрутизацию, middleware, кеширование, интернационализацию и многое другое. Фреймворк использует паттерн MVT (Model-View-Template) и включает в себя мощную систему миграций, автоматическую генерацию админки и встроенную защиту от CSRF, XSS и других атак. Django идеально подходит для создания сложных веб-приложений, CMS, e-commerce платформ и корпоративных решений с акцентом на безопасность и масштабируемость.',
-                "github": "https://github.com/django/django",
-                "code_example": """
-from django.db import models
-from django.shortcuts import render
-
-class User(models.Model):
-    name = models.CharField(max_length=100)
-    email = models.EmailField()
-
-def user_list(request):
-    users = User.objects.all()
-    return render(request, 'users/list.html', {'users': users})""",
-            },
-            {
-                "name": "PyAudio",
-                "description": "Мощная библиотека для работы со звуком в Python, основанная на PortAudio. PyAudio предоставляет простой и удобный интерфейс для записи и воспроизведения аудио, обработки звуковых сигналов в реальном времени и создания аудио-приложений. Библиотека поддерживает множество аудио форматов, различные устройства ввода/вывода, настройку параметров качества звука и работу с аудио потоками. PyAudio широко используется для создания музыкальных приложений, систем распознавания речи, аудио анализа, подкастов, стриминга и других проектов, связанных со звуком. Предоставляет кроссплатформенный API для работы с аудио на Windows, macOS и Linux.",
-                "github": "https://github.com/intxcc/pyaudio_portaudio",
-                "code_example": """
-import pyaudio
-import wave
-
-chunk = 1024
-format = pyaudio.paInt16
-channels = 2
-rate = 44100
-
-p = pyaudio.PyAudio()
-stream = p.open(format=format, channels=channels, rate=rate, input=True)
-frames = stream.read(chunk)""",
-            },
-            {
-                "name": "NumPy",
-                "description": "Фундаментальная библиотека для научных вычислений в Python, предоставляющая мощные N-мерные массивы и инструменты для работы с ними. NumPy является основой для большинства научных библиотек Python, включая SciPy, Pandas, Matplotlib и scikit-learn. Библиотека обеспечивает высокую производительность благодаря реализации на C и оптимизированным алгоритмам линейной алгебры. NumPy включает в себя функции для математических операций, статистики, линейной алгебры, преобразований Фурье, генерации случайных чисел и работы с массивами. Широко используется в data science, машинном обучении, научных исследованиях, финансовом анализе и инженерных расчетах.",
-                "github": "https://github.com/numpy/numpy",
-                "code_example": """
-import numpy as np
-
-arr = np.array([1, 2, 3, 4, 5])
-matrix = np.random.rand(3, 3)
-
-result = np.dot(matrix, arr)
-print(result)""",
-            },
-            {
-                "name": "FastAPI",
-                "description": "Современный, быстрый веб-фреймворк для создания API с Python, основанный на Starlette и Pydantic. FastAPI предоставляет автоматическую генерацию OpenAPI документации, валидацию данных на основе type hints, асинхронную поддержку и высокую производительность, сравнимую с Node.js и Go. Фреймворк включает в себя встроенную поддержку WebSockets, GraphQL, OAuth2, JWT, CORS, dependency injection и тестирования. FastAPI идеально подходит для создания высокопроизводительных API, микросервисов, real-time приложений и интеграционных сервисов. Предоставляет отличный developer experience с автоматическими подсказками в IDE и подробной документацией.",
-                "github": "https://github.com/tiangolo/fastapi",
-                "code_example": """
-from fastapi import FastAPI
-from pydantic import BaseModel
-
-app = FastAPI()
-
-class User(BaseModel):
-    name: str
-    age: int
+def slugify(name):
+    """ASCII-слаг для URL и якоря: транслит, все прочее - дефисы"""
+    name = unicodedata.normalize("NFKD", name.lower().translate(TRANSLIT))
+    name = name.encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "-", name).strip("-")
+
+
+def load_language(data):
+    """Собирает неизменяемую модель языка с подсвеченным кодом проектов"""
+    projects = []
+    anchors = set()
+    for project in data["projects"]:
+        # Слаг уникален в пределах языка, даже если имена различались лишь знаками
+        base = slugify(project["name"]) or "project"
+        anchor, number = base, 1
+        while anchor in anchors:
+            number += 1
+            anchor = f"{base}-{number}"
+        anchors.add(anchor)
+        code = project.get("code_example", "")
+        code_html = highlight_store.get(code, data["slug"]) if code else ""
+        projects.append(
+            Project(
+                name=project["name"],
+                description=project["description"],
+                github=project["github"],
+                code_example=code,
+                code_html=Markup(code_html),
+                anchor=anchor,
+            )
+        )
+    return Language(
+        name=data["name"],
+        slug=data["slug"],
+        order=data["order"],
+        description=data["description"],
+        icon=data["icon"],
+        features=tuple(Feature(**feature) for feature in data["features"]),
+        history=History(**data["history"]),
+        projects=tuple(projects),
+        digest=hashlib.sha256(
+            json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest(),
+    )
+
+
+class ContentStore:
+    """Контент языков из файлов content/<slug>.json.
+
+    Файл языка читается при первом обращении к нему. Не чаще раза в
+    reload_interval секунд каталог проверяется на изменение mtime:
+    измененные языки перечитываются и подменяются целиком, а version,
+    входящая в ключи кеша страниц, меняется.
+    """
+
+    def __init__(self, directory, reload_interval):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._version = ""
+        self._stamps = {}
+        self._languages = {}
+        # Файлы, которые не удалось прочитать: повтор только после их изменения
+        self._failed = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        self.refresh()
+        return self._version
+
+    def _scan(self):
+        stamps = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                slug, ext = os.path.splitext(entry.name)
+                if ext == ".json" and entry.is_file():
+                    stat = entry.stat()
+                    stamps[slug] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    def _read(self, slug):
+        path = os.path.join(self.directory, f"{slug}.json")
+        with open(path, encoding="utf-8") as f:
+            return load_language(json.load(f))
+
+    def _save_highlights(self):
+        highlight_store.prune(list(self._languages.values()), set(self._stamps))
+        highlight_store.flush()
+
+    def refresh(self):
+        now = time.monotonic()
+        checked_at = self._checked_at
+        if checked_at is not None and now - checked_at < self.reload_interval:
+            return
+        with self._lock:
+            if self._checked_at != checked_at:
+                return
+            stamps = self._scan()
+            if stamps != self._stamps:
+                languages = {}
+                for slug, language in self._languages.items():
+                    if slug not in stamps:
+                        continue
+                    if stamps[slug] != self._stamps.get(slug):
+                        try:
+                            language = self._read(slug)
+                        except (OSError, ValueError, KeyError, TypeError) as e:
+                            # Остается прежняя версия языка до следующего изменения файла
+                            logger.error(f"Не удалось перечитать {slug}: {e}")
+                            self._failed[slug] = stamps[slug]
+                    languages[slug] = language
+                self._failed = {
+                    slug: stamp
+                    for slug, stamp in self._failed.items()
+                    if stamps.get(slug) == stamp
+                }
+                version = hashlib.sha256(
+                    json.dumps(sorted(stamps.items())).encode("ascii")
+                ).hexdigest()[:16]
+                self._stamps = stamps
+                self._languages = languages
+                self._save_highlights()
+                if checked_at is not None and version != self._version:
+                    logger.info(f"Контент обновлен, версия {version}")
+                self._version = version
+            self._checked_at = now
+
+    def get(self, slug):
+        self.refresh()
+        language = self._languages.get(slug)
+        if language is None and self._readable(slug):
+            with self._lock:
+                language = self._languages.get(slug)
+                if language is None and self._readable(slug):
+                    try:
+                        language = self._read(slug)
+                    except (OSError, ValueError, KeyError, TypeError) as e:
+                        logger.error(f"Не удалось прочитать {slug}: {e}")
+                        self._failed[slug] = self._stamps[slug]
+                        return None
+                    self._languages = {**self._languages, slug: language}
+                    self._save_highlights()
+        return language
+
+    def _readable(self, slug):
+        stamp = self._stamps.get(slug)
+        return stamp is not None and self._failed.get(slug) != stamp
+
+    def all(self):
+        self.refresh()
+        languages = [self.get(slug) for slug in self._stamps]
+        return sorted(
+            (language for language in languages if language is not None),
+            key=lambda language: language.order,
+        )
+
+
+content = ContentStore(CONTENT_DIR, CONTENT_RELOAD_INTERVAL)
+
+
+def build_page(html, mimetype="text/html"):
+    """Готовит закешированную страницу: тело, сжатые варианты и ETag"""
+    body = html.encode("utf-8")
+    variants = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=11)
+    return {
+        "etag": hashlib.sha256(body).hexdigest()[:32],
+        "mimetype": mimetype,
+        "body": body,
+        "variants": variants,
+    }
+
+
+def page_response(page):
+    """Отдает закешированную страницу с учетом Accept-Encoding и If-None-Match"""
+    encoding = request.accept_encodings.best_match(
+        [name for name in ("br", "gzip") if name in page["variants"]]
+    )
+    if encoding:
+        response = Response(page["variants"][encoding], mimetype=page["mimetype"])
+        response.content_encoding = encoding
+        response.set_etag(f'{page["etag"]}-{encoding}')
+    else:
+        response = Response(page["body"], mimetype=page["mimetype"])
+        response.set_etag(page["etag"])
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def stream_compressor(encoding):
+    """Сжатие потока: (сжать кусок со сбросом, завершить поток)"""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=STREAM_BROTLI_QUALITY)
+        return (
+            lambda data: compressor.process(data) + compressor.flush(),
+            compressor.finish,
+        )
+    if encoding == "gzip":
+        compressor = zlib.compressobj(STREAM_GZIP_LEVEL, zlib.DEFLATED, 31)
+        return (
+            lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH),
+            compressor.flush,
+        )
+    return (lambda data: data), (lambda: b"")
+
+
+# Ключ страницы -> поток, который кладет ее в кеш
+page_fills = {}
+page_fills_lock = threading.Lock()
+
+
+def fill_page_cache(key, html, mimetype):
+    """Сжимает и кладет страницу в кеш в фоне, не задерживая конец ответа.
+
+    Пока страница с тем же ключом уже заполняется, новый поток не запускается.
+    """
+
+    def fill():
+        try:
+            with app.app_context():
+                cache.set(
+                    key,
+                    build_page(html, mimetype),
+                    timeout=app.config["PAGE_CACHE_TIMEOUT"],
+                )
+        finally:
+            with page_fills_lock:
+                page_fills.pop(key, None)
+
+    with page_fills_lock:
+        if key in page_fills:
+            return
+        thread = page_fills[key] = threading.Thread(
+            target=fill, name="page-fill", daemon=True
+        )
+        thread.start()
+
+
+def wait_page_fills():
+    with page_fills_lock:
+        threads = list(page_fills.values())
+    for thread in threads:
+        thread.join()
+
 
-@app.get("/")
-async def root():
-    return {"message": "Hello World"}
+def stream_page(template_name, **context):
+    """Рендерит шаблон кусками, разделенными вызовами flush() в шаблоне"""
+    g.streaming = True
+    template = app.jinja_env.get_or_select_template(template_name)
+    app.update_template_context(context)
+    buffer = []
+    for part in template.generate(context):
+        *ready, rest = part.split(FLUSH_MARKER)
+        for piece in ready:
+            buffer.append(piece)
+            yield "".join(buffer)
+            buffer = []
+        buffer.append(rest)
+    yield "".join(buffer)
 
-@app.post("/users/")
-async def create_user(user: User):
-    return {"user": user}""",
-            },
-        ],
-        "icon": "python",
-    },
-]
 
+def stream_response(chunks, key, mimetype):
+    """Отдает страницу по мере рендера и после отправки кладет ее в кеш.
 
-@app.route("/")
+    Клиент получает <head> и навигацию до рендера остальной страницы, а
+    промах кеша не держит ответ до сжатия brotli максимального уровня.
+    """
+    encoding = request.accept_encodings.best_match(
+        ["br", "gzip"] if brotli is not None else ["gzip"]
+    )
+    compress, finish = stream_compressor(encoding)
+
+    def generate():
+        html = []
+        while True:
+            with phase("render"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            html.append(chunk)
+            with phase("compress"):
+                data = compress(chunk.encode("utf-8"))
+            if data:
+                yield data
+        data = finish()
+        if data:
+            yield data
+        fill_page_cache(key, "".join(html), mimetype)
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def cached_page(view):
+    """Кеширует отрендеренную страницу целиком до изменения контента.
+
+    Если view отдает генератор stream_page, промах кеша отдается потоком.
+    """
+
+    @wraps(view)
+    def wrapper(**kwargs):
+        key = (
+            f"page:{RELEASE}:{content.version}:{asset_manifest.version}:"
+            f"{request.path}"
+        )
+        with phase("cache"):
+            page = cache.get(key)
+        registry.inc(
+            "page_cache_requests_total",
+            (("route", request_route()), ("result", "miss" if page is None else "hit")),
+        )
+        if page is None:
+            rv = view(**kwargs)
+            if isinstance(rv, types.GeneratorType):
+                return stream_response(
+                    rv, key, mimetypes.guess_type(request.path)[0] or "text/html"
+                )
+            if not isinstance(rv, str):
+                return rv
+            with phase("compress"):
+                page = build_page(
+                    rv, mimetypes.guess_type(request.path)[0] or "text/html"
+                )
+            with phase("cache"):
+                cache.set(key, page, timeout=app.config["PAGE_CACHE_TIMEOUT"])
+        return page_response(page)
+
+    return wrapper
+
+
+page_graph = pages.PageGraph(app, lambda: content.version)
+
+
+@page_graph.route("/", "index.html")
 def index():
     """Главная страница"""
-    return render_template("index.html", languages=LANGUAGES)
+    languages = content.all()
+    yield {}, {"languages": languages}, [language.digest for language in languages]
 
 
-@app.route("/about")
+@page_graph.route("/about", "about.html")
 def about():
     """Страница О нас"""
-    return render_template("about.html")
+    yield {}, {}, None
 
 
-@app.route("/<language_slug>")
-def language_page(language_slug):
+@page_graph.route("/<language_slug>", "language.html")
+def language_page():
     """Страница языка"""
-    language = next((lang for lang in LANGUAGES if lang["slug"] == language_slug), None)
-    if not language:
-        return "Язык не найден", 404
-    return render_template("language.html", language=language)
+    for language in content.all():
+        yield {"language_slug": language.slug}, {"language": language}, language.digest
 
 
-@app.route("/<language_slug>/history")
-def language_history(language_slug):
+@page_graph.route("/<language_slug>/history", "history.html", stream=True)
+def language_history():
     """История языка"""
-    language = next((lang for lang in LANGUAGES if lang["slug"] == language_slug), None)
-    if not language:
-        return "Язык не найден", 404
-    return render_template("history.html", language=language)
+    for language in content.all():
+        yield {"language_slug": language.slug}, {"language": language}, language.digest
 
 
-@app.route("/<language_slug>/projects")
-def language_projects(language_slug):
+@page_graph.route("/<language_slug>/projects", "projects.html", stream=True)
+def language_projects():
     """Проекты языка"""
-    language = next((lang for lang in LANGUAGES if lang["slug"] == language_slug), None)
-    if not language:
-        return "Язык не найден", 404
+    for language in content.all():
+        yield {"language_slug": language.slug}, {"language": language}, language.digest
+
+
+@page_graph.route("/<language_slug>/features", "features.html")
+def language_features():
+    """Особенности языка"""
+    for language in content.all():
+        yield {"language_slug": language.slug}, {"language": language}, language.digest
+
+
+@page_graph.route("/<language_slug>/versions", "versions.html")
+def language_versions():
+    """Первые версии языка"""
+    for language in content.all():
+        yield {"language_slug": language.slug}, {"language": language}, language.digest
+
+
+@page_graph.route("/<language_slug>/projects/<project_slug>", "project_detail.html")
+def project_detail():
+    """Страница проекта"""
+    for language in content.all():
+        for project in language.projects:
+            yield (
+                {"language_slug": language.slug, "project_slug": project.anchor},
+                {"language": language, "project": project, "code_highlight": True},
+                language.digest,
+            )
+
+
+@cached_page
+def graph_page(**values):
+    """Страница из графа: контекст собран заранее, рендер берется из кеша"""
+    with phase("lookup"):
+        page = page_graph.get(request.path)
+    if page is None:
+        return "Страница не найдена", 404
+    if page.stream:
+        return stream_page(page.template, **page.context)
+    return render_template(page.template, **page.context)
+
 
-    import copy
+page_graph.register(graph_page)
 
-    language_copy = copy.deepcopy(language)
-    for project in language_copy["projects"]:
-        if "code_example" in project:
-            highlighted = highlight_code(project["code_example"], language_slug)
-            project["code_example"] = highlighted
 
-    return render_template("projects.html", language=language_copy)
+@app.route("/sw.js")
+@cached_page
+def service_worker():
+    """Service worker со списком всех страниц и хешированных ассетов"""
+    pages = [path for path, _, _ in site_pages()]
+    asset_urls = [
+        url_for("static", filename=name) for name in sorted(asset_manifest.files)
+    ]
+    # RELEASE: деплой только шаблонов или кода тоже должен сменить прекеш страниц
+    version = hashlib.sha256(
+        json.dumps([RELEASE, pages, asset_urls, content.version]).encode("utf-8")
+    ).hexdigest()[:12]
+    return render_template(
+        "sw.js",
+        version=version,
+        pages=pages,
+        assets=asset_urls,
+        hashed_prefix=url_for("static", filename=f"{ASSET_DIR}/"),
+    )
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Метрики всех воркеров в формате Prometheus"""
+    return Response(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def site_pages():
+    """Все страницы сайта: (путь, шаблон, данные, от которых зависит страница)"""
+    return [(page.path, page.template, page.data) for page in page_graph]
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def export_site(output_dir):
+    """Пререндерит все страницы и статику в каталог для раздачи через nginx.
+
+    Экспорт инкрементальный: страница перезаписывается только если
+    изменились ее данные, хеши ассетов или релиз (код и все шаблоны,
+    включая partials и base.html), статика - только если изменилось
+    содержимое файла.
+    """
+    build_assets()
+    manifest_path = os.path.join(output_dir, ".export-manifest.json")
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+
+    manifest = {}
+    written = 0
+    client = app.test_client()
+    outputs = site_pages() + [("/sw.js", "sw.js", content.version)]
+    for path, template, data in outputs:
+        fingerprint = hashlib.sha256(
+            json.dumps(
+                [
+                    RELEASE,
+                    template,
+                    data,
+                    asset_manifest.version,
+                    HIGHLIGHT_OPTIONS,
+                    HIGHLIGHT_VERSION,
+                ],
+                ensure_ascii=False,
+                sort_keys=True,
+            ).encode("utf-8")
+        ).hexdigest()
+        name = path.strip("/")
+        if not os.path.splitext(name)[1]:
+            name = os.path.join(name, "index.html")
+        target = os.path.join(output_dir, name)
+        manifest[name] = fingerprint
+        if previous.get(name) == fingerprint and os.path.exists(target):
+            continue
+
+        response = client.get(path)
+        if response.status_code != 200:
+            # Ошибка не должна попасть в экспорт и в манифест как актуальная страница
+            raise RuntimeError(f"Экспорт прерван: {path} отвечает {response.status}")
+        page = build_page(response.get_data(as_text=True))
+        write_file(target, page["body"])
+        write_file(f"{target}.gz", page["variants"]["gzip"])
+        if "br" in page["variants"]:
+            write_file(f"{target}.br", page["variants"]["br"])
+        written += 1
+
+    for root, _, files in os.walk(app.static_folder):
+        for name in files:
+            source = os.path.join(root, name)
+            name = os.path.join("static", os.path.relpath(source, app.static_folder))
+            target = os.path.join(output_dir, name)
+            fingerprint = file_digest(source)
+            manifest[name] = fingerprint
+            if previous.get(name) == fingerprint and os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            written += 1
+
+    for name in previous.keys() - manifest.keys():
+        target = os.path.join(output_dir, name)
+        for stale in (target, f"{target}.gz", f"{target}.br"):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    logger.info(f"Экспорт в {output_dir}: обновлено {written} из {len(manifest)} файлов")
+
+
+def warm():
+    """Загружает весь контент и рендерит все страницы в кеш.
+
+    С preload_app вызывается в мастер-процессе gunicorn до fork, и воркеры
+    получают подсветку, контент и страницы через copy-on-write. Кеш
+    очищается, чтобы в общем бэкенде не остались страницы прошлого деплоя.
+    Устаревшая сборка статики пересобирается до рендера страниц.
+    """
+    build_assets(force=False)
+    cache.clear()
+    client = app.test_client()
+    for path, _, _ in site_pages():
+        response = client.get(path)
+        response.get_data()
+        response.close()
+    # Потоковые страницы попадают в кеш из фоновых потоков
+    wait_page_fills()
+    # Прогрев не должен попасть в метрики воркеров, унаследовавших их через fork
+    registry.reset()
+    if hasattr(cache.cache, "reset_stats"):
+        cache.cache.reset_stats()
+
+
+def serve(bind=None, workers=None):
+    """Запускает gunicorn с uvicorn-воркерами по настройкам gunicorn.conf.py"""
+    from gunicorn.app.wsgiapp import WSGIApplication
+
+    argv = ["gunicorn", "--config", os.path.join(app.root_path, "gunicorn.conf.py")]
+    if bind:
+        argv += ["--bind", bind]
+    if workers:
+        argv += ["--workers", str(workers)]
+    sys.argv = argv
+    # asgi.py импортирует run: без псевдонима модуль выполнился бы второй раз
+    # под этим именем со своим приложением, очередью логов и метриками
+    sys.modules.setdefault("run", sys.modules[__name__])
+    WSGIApplication("%(prog)s [OPTIONS]").run()
 
 
 if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=8000, debug=False)
+    parser = argparse.ArgumentParser(description="async.pw")
+    subparsers = parser.add_subparsers(dest="command")
+    export_parser = subparsers.add_parser(
+        "export", help="пререндерить сайт в статический каталог"
+    )
+    export_parser.add_argument("output_dir", nargs="?", default="build/site")
+    subparsers.add_parser(
+        "build-assets", help="минифицировать и захешировать статику в static/dist"
+    )
+    subparsers.add_parser(
+        "vendor", help="скачать и урезать devicon и JetBrains Mono в static/vendor"
+    )
+    serve_parser = subparsers.add_parser(
+        "serve", help="production-сервер (gunicorn + uvicorn, ASGI)"
+    )
+    serve_parser.add_argument("--bind", help="адрес, по умолчанию из $BIND")
+    serve_parser.add_argument("--workers", type=int, help="число воркеров")
+    subparsers.add_parser("dev", help="отладочный сервер Flask")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_site(args.output_dir)
+    elif args.command == "build-assets":
+        build_assets()
+    elif args.command == "vendor":
+        fetch_vendor()
+        build_assets()
+    elif args.command == "dev":
+        build_assets(force=False)
+        app.run(host="127.0.0.1", port=8000, debug=False)
+    else:
+        serve(getattr(args, "bind", None), getattr(args, "workers", None))
@@ -300,7 +300,7 @@ document.addEventListener("DOMContentLoaded", () => {
 if ("serviceWorker" in navigator) {
   window.addEventListener("load", () => {
     navigator.serviceWorker
-      .register("/static/js/sw.js")
+      .register("/sw.js")
       .then((registration) => {
         console.log("SW registered: ", registration);
       })
@@ -1,13 +1,13 @@
-const STATIC_CACHE = "async-pw-static-v1";
-const DYNAMIC_CACHE = "async-pw-dynamic-v1";
+// Генерируется сервером из таблицы маршрутов и манифеста статики,
+// версия меняется при каждом деплое и изменении контента или ассетов
+const VERSION = {{ version|tojson }};
+const STATIC_CACHE = `async-pw-static-${VERSION}`;
+const PAGES_CACHE = `async-pw-pages-${VERSION}`;
 
 // Ресурсы для кеширования
-const STATIC_ASSETS = [
-  "/",
-  "/static/css/styles.css",
-  "/static/js/main.js",
-  "https://fonts.googleapis.com/css2?family=JetBrains+Mono:wght@300;400;500;600&display=swap",
-];
+const PRECACHE_PAGES = {{ pages|tojson }};
+const PRECACHE_ASSETS = {{ assets|tojson }};
+const HASHED_ASSETS_PREFIX = {{ hashed_prefix|tojson }};
 
 // Установка Service Worker
 self.addEventListener("install", (event) => {
@@ -18,7 +18,12 @@ self.addEventListener("install", (event) => {
       .open(STATIC_CACHE)
       .then((cache) => {
         console.log("Service Worker: Caching static assets");
-        return cache.addAll(STATIC_ASSETS);
+        return cache.addAll(PRECACHE_ASSETS);
+      })
+      .then(() => caches.open(PAGES_CACHE))
+      .then((cache) => {
+        console.log("Service Worker: Caching pages");
+        return cache.addAll(PRECACHE_PAGES);
       })
       .then(() => {
         console.log("Service Worker: Installation complete");
@@ -37,7 +42,7 @@ self.addEventListener("activate", (event) => {
       .then((cacheNames) => {
         return Promise.all(
           cacheNames.map((cacheName) => {
-            if (cacheName !== STATIC_CACHE && cacheName !== DYNAMIC_CACHE) {
+            if (cacheName !== STATIC_CACHE && cacheName !== PAGES_CACHE) {
               console.log("Service Worker: Deleting old cache:", cacheName);
               return caches.delete(cacheName);
             }
@@ -57,17 +62,15 @@ self.addEventListener("fetch", (event) => {
   const url = new URL(request.url);
 
   // Стратегия кеширования для разных типов ресурсов
-  if (request.method === "GET") {
-    if (url.pathname.startsWith("/static/")) {
-      // Статические ресурсы - Cache First
-      event.respondWith(cacheFirst(request));
-    } else if (url.pathname.startsWith("/api/")) {
-      // API - Network First
-      event.respondWith(networkFirst(request));
-    } else {
-      // HTML страницы - Stale While Revalidate
-      event.respondWith(staleWhileRevalidate(request));
-    }
+  if (request.method !== "GET" || url.origin !== self.location.origin) {
+    return;
+  }
+  if (url.pathname.startsWith(HASHED_ASSETS_PREFIX)) {
+    // Хешированные ресурсы не меняются - Cache First
+    event.respondWith(cacheFirst(request));
+  } else if (request.mode === "navigate") {
+    // HTML страницы - Stale While Revalidate
+    event.respondWith(staleWhileRevalidate(request));
   }
 });
 
@@ -97,36 +100,12 @@ async function cacheFirst(request) {
   }
 }
 
-/**
- * Network First стратегия
- * Сначала сеть, затем кеш
- */
-async function networkFirst(request) {
-  try {
-    const networkResponse = await fetch(request);
-    if (networkResponse.ok) {
-      const cache = await caches.open(DYNAMIC_CACHE);
-      cache.put(request, networkResponse.clone());
-    }
-    return networkResponse;
-  } catch (error) {
-    console.log("Network failed, trying cache:", error);
-    const cachedResponse = await caches.match(request);
-    if (cachedResponse) {
-      return cachedResponse;
-    }
-    return new Response("Offline", {
-      status: 503,
-    });
-  }
-}
-
 /**
  * Stale While Revalidate стратегия
  * Возвращаем кеш, обновляем в фоне
  */
 async function staleWhileRevalidate(request) {
-  const cache = await caches.open(DYNAMIC_CACHE);
+  const cache = await caches.open(PAGES_CACHE);
   const cachedResponse = await cache.match(request);
 
   const fetchPromise = fetch(request)
@@ -158,7 +137,7 @@ self.addEventListener("periodicsync", (event) => {
 async function cleanupCache() {
   const cacheNames = await caches.keys();
   const oldCaches = cacheNames.filter(
-    (name) => name !== STATIC_CACHE && name !== DYNAMIC_CACHE,
+    (name) => name !== STATIC_CACHE && name !== PAGES_CACHE,
   );
 
   await Promise.all(oldCaches.map((cacheName) => caches.delete(cacheName)));
@@ -0,0 +1,76 @@
+import assets
+
+
+def test_minify_css_removes_comments_and_spaces():
+    css = "/* заголовок */\nh1 ,  h2 {\n  color: red ;\n  margin: 0;\n}\n"
+    assert assets.minify_css(css) == "h1,h2{color:red;margin:0}"
+
+
+def test_minify_css_keeps_strings():
+    css = "a::before { content: \"a , b\"; font-family: 'Fira  Code', x; }"
+    assert assets.minify_css(css) == (
+        "a::before{content:\"a , b\";font-family:'Fira  Code',x}"
+    )
+
+
+def test_minify_css_keeps_comment_markers_in_strings():
+    css = 'a::after { content: "/* не комментарий */"; }'
+    assert assets.minify_css(css) == 'a::after{content:"/* не комментарий */"}'
+
+
+def test_minify_js_strips_comments_and_indentation():
+    js = "function f() {\n    // комментарий\n    return 1; /* и этот */\n}\n\n\nf();\n"
+    assert assets.minify_js(js) == "function f() {\nreturn 1;\n}\nf();"
+
+
+def test_minify_js_keeps_template_literals():
+    js = "const s = `первая\n\n    с отступом ${x}`;\n    g();"
+    assert assets.minify_js(js) == "const s = `первая\n\n    с отступом ${x}`;\ng();"
+
+
+def test_minify_js_keeps_strings_and_regex():
+    js = 'if (/a  \\/\\/ b/.test("x  // y")) {\n  z();\n}'
+    assert assets.minify_js(js) == 'if (/a  \\/\\/ b/.test("x  // y")) {\nz();\n}'
+
+
+def test_optimize_svg_drops_editor_data_and_hoists_attributes():
+    svg = (
+        '<svg xmlns="http://www.w3.org/2000/svg" '
+        'xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" version="1.1">'
+        "<metadata>meta</metadata>\n"
+        '  <g inkscape:label="слой">\n'
+        '    <path d="M 0.5 0.5 L 1 1" fill="red"/>\n'
+        '    <circle r="0.25" fill="red"/>\n'
+        "  </g>\n"
+        "</svg>"
+    )
+    assert assets.optimize_svg(svg) == (
+        '<svg xmlns="http://www.w3.org/2000/svg"><g fill="red">'
+        '<path d="M .5 .5 L 1 1"/><circle r="0.25"/></g></svg>'
+    )
+
+
+def test_optimize_svg_keeps_opacity_on_children():
+    svg = (
+        '<svg xmlns="http://www.w3.org/2000/svg"><g>'
+        '<rect width="2" opacity="0.5"/><rect x="1" width="2" opacity="0.5"/>'
+        "</g></svg>"
+    )
+    assert assets.optimize_svg(svg) == (
+        '<svg xmlns="http://www.w3.org/2000/svg"><g>'
+        '<rect width="2" opacity=".5"/><rect x="1" width="2" opacity=".5"/>'
+        "</g></svg>"
+    )
+
+
+def test_source_digest_tracks_sources_and_config(tmp_path):
+    (tmp_path / "a.css").write_text("a { color: red }")
+    output = tmp_path / "dist"
+    digest = assets.source_digest(str(tmp_path), str(output), config=[1])
+    assets.build(str(tmp_path), str(output))
+    assets.save_source_digest(str(output), digest)
+    assert assets.Manifest(str(output)).sources == digest
+    assert assets.source_digest(str(tmp_path), str(output), config=[1]) == digest
+    assert assets.source_digest(str(tmp_path), str(output), config=[2]) != digest
+    (tmp_path / "a.css").write_text("a { color: blue }")
+    assert assets.source_digest(str(tmp_path), str(output), config=[1]) != digest
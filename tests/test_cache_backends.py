@@ -0,0 +1,110 @@
+import os
+import pwd
+
+import pytest
+
+import cache_backends
+
+PAGE = {
+    "etag": "abc",
+    "mimetype": "text/html",
+    "body": b"<html>\x00</html>",
+    "variants": {"gzip": b"\x1f\x8b", "br": b""},
+}
+
+
+def test_encode_roundtrip():
+    assert cache_backends.decode(cache_backends.encode(PAGE)) == PAGE
+
+
+def test_encode_rejects_arbitrary_objects():
+    with pytest.raises(TypeError):
+        cache_backends.encode({"value": object()})
+
+
+def test_local_lru_evicts_least_recently_used():
+    cache = cache_backends.LocalLRUCache(max_bytes=200)
+    cache.set("a", b"x" * 80)
+    cache.set("b", b"x" * 80)
+    assert cache.get("a") is not None
+    cache.set("c", b"x" * 80)
+    assert cache.has("a") and cache.has("c") and not cache.has("b")
+    assert cache.stats() == {"hits": 1, "misses": 0}
+
+
+def test_shared_memory_cache(tmp_path):
+    cache = cache_backends.SharedMemoryCache(path=str(tmp_path / "cache.sqlite3"))
+    assert cache.get("page") is None
+    assert cache.set("page", PAGE)
+    assert not cache.add("page", {})
+    assert cache.get("page") == PAGE
+    assert cache.stats() == {"hits": 1, "misses": 1}
+    cache.clear()
+    assert not cache.has("page")
+
+
+def test_shared_memory_cache_evicts_by_size(tmp_path):
+    cache = cache_backends.SharedMemoryCache(
+        path=str(tmp_path / "cache.sqlite3"), max_bytes=300
+    )
+    cache.set("a", b"x" * 100)
+    cache.set("b", b"x" * 100)
+    cache.set("c", b"x" * 100)
+    assert not cache.has("a") and cache.has("c")
+
+
+@pytest.mark.skipif(os.getuid() != 0, reason="нужен root, чтобы сменить владельца")
+def test_shared_memory_cache_refuses_foreign_file(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    path.touch()
+    os.chown(path, pwd.getpwnam("nobody").pw_uid, -1)
+    with pytest.raises(PermissionError):
+        cache_backends.SharedMemoryCache(path=str(path))
+
+
+def test_private_dir_is_owner_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_backends, "SHM_DIR", str(tmp_path))
+    path = cache_backends.private_dir("test")
+    assert os.stat(path).st_mode & 0o777 == 0o700
+    os.chmod(path, 0o777)
+    with pytest.raises(PermissionError):
+        cache_backends.private_dir("test")
+
+
+@pytest.fixture
+def redis_cache():
+    fakeredis = pytest.importorskip("fakeredis")
+    return cache_backends.RedisLRUCache(
+        host=fakeredis.FakeRedis(), key_prefix="test:", default_timeout=300
+    )
+
+
+def test_redis_get_set(redis_cache):
+    assert redis_cache.get("page") is None
+    assert redis_cache.set("page", PAGE)
+    assert redis_cache.get("page") == PAGE
+    assert redis_cache.stats() == {"hits": 1, "misses": 1}
+
+
+def test_redis_timeout(redis_cache):
+    redis_cache.set("page", PAGE, timeout=60)
+    assert 0 < redis_cache._read_client.ttl("test:page") <= 60
+    redis_cache.set("forever", PAGE, timeout=0)
+    assert redis_cache._read_client.ttl("test:forever") == -1
+
+
+def test_redis_counters(redis_cache):
+    assert redis_cache.inc("hits") == 1
+    assert redis_cache.get("hits") == 1
+    assert redis_cache.dec("hits", 3) == -2
+    assert redis_cache.get("hits") == -2
+    redis_cache.set("views", 5)
+    assert redis_cache.inc("views") == 6
+    assert redis_cache.get("views") == 6
+
+
+def test_redis_get_many(redis_cache):
+    redis_cache.set("a", PAGE)
+    redis_cache.set("b", b"\x00")
+    assert redis_cache.get_many("a", "missing", "b") == [PAGE, None, b"\x00"]
+    assert redis_cache.stats() == {"hits": 2, "misses": 1}
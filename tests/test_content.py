@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import run
+
+CONTENT = os.path.join(os.path.dirname(run.__file__), "content")
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        run, "highlight_store", run.HighlightStore(str(tmp_path / "highlight.json"))
+    )
+    directory = tmp_path / "content"
+    shutil.copytree(CONTENT, directory)
+    return run.ContentStore(str(directory), reload_interval=0)
+
+
+def rewrite(store, slug, text):
+    path = os.path.join(store.directory, f"{slug}.json")
+    stat = os.stat(path)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    # mtime мог не смениться за время теста: сдвигаем его явно
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_reload_replaces_changed_language(store):
+    store.get("rust")
+    version = store.version
+    with open(os.path.join(store.directory, "rust.json"), encoding="utf-8") as f:
+        data = json.load(f)
+    data["name"] = "Rust 2"
+    rewrite(store, "rust", json.dumps(data, ensure_ascii=False))
+    assert store.get("rust").name == "Rust 2"
+    assert store.version != version
+
+
+def test_broken_file_keeps_previous_language(store, caplog):
+    name = store.get("rust").name
+    rewrite(store, "rust", '{"name": ')
+    assert store.get("rust").name == name
+    version = store.version
+    for _ in range(3):
+        store.refresh()
+    assert store.version == version
+    errors = [r for r in caplog.records if r.levelname == "ERROR"]
+    assert len(errors) == 1
+    # Исправленный файл снова читается
+    with open(os.path.join(CONTENT, "rust.json"), encoding="utf-8") as f:
+        rewrite(store, "rust", f.read())
+    assert store.get("rust").name == name
+    assert not store._failed
+
+
+def test_broken_file_before_first_read_is_missing(store, caplog):
+    with open(os.path.join(store.directory, "go.json"), "w", encoding="utf-8") as f:
+        f.write("not json")
+    assert store.get("go") is None
+    assert store.get("go") is None
+    assert [language.slug for language in store.all()] == [
+        language.slug for language in run.content.all()
+    ]
+    assert len([r for r in caplog.records if r.levelname == "ERROR"]) == 1
+
+
+def test_deleted_file_drops_language(store):
+    assert store.get("python") is not None
+    version = store.version
+    os.remove(os.path.join(store.directory, "python.json"))
+    assert store.get("python") is None
+    assert "python" not in [language.slug for language in store.all()]
+    assert store.version != version
@@ -0,0 +1,10 @@
+import highlighting
+
+
+def test_plain_html_escapes_code():
+    html = highlighting.plain_html('<script>alert("x")</script>', "go")
+    assert html == (
+        '<pre><code class="language-go">'
+        "&lt;script&gt;alert(&#34;x&#34;)&lt;/script&gt;</code></pre>"
+    )
+
@@ -0,0 +1,67 @@
+import json
+import os
+import threading
+import time
+
+import metrics
+
+LABELS = (("route", "index"),)
+
+
+def snapshot_file(directory, pid, value):
+    with open(os.path.join(directory, f"{pid}.json"), "w", encoding="utf-8") as f:
+        json.dump({"counters": [["hits", [list(LABELS[0])], value]], "histograms": []}, f)
+
+
+def test_collect_sums_processes(tmp_path):
+    registry = metrics.Registry(str(tmp_path))
+    registry.inc("hits", LABELS, 2)
+    registry.observe("duration", (), 0.003)
+    counters, histograms = registry.collect()
+    assert counters == {("hits", LABELS): 2}
+    assert sum(histograms[("duration", ())][:-1]) == 1
+
+
+def test_dead_process_is_folded_into_totals(tmp_path):
+    pid = os.fork()
+    if not pid:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    snapshot_file(tmp_path, pid, 5)
+    registry = metrics.Registry(str(tmp_path))
+    registry.inc("hits", LABELS)
+    assert registry.collect()[0] == {("hits", LABELS): 6}
+    assert not (tmp_path / f"{pid}.json").exists()
+    assert registry.collect()[0] == {("hits", LABELS): 6}
+
+
+def test_reused_pid_does_not_drop_predecessor(tmp_path):
+    snapshot_file(tmp_path, os.getpid(), 5)
+    registry = metrics.Registry(str(tmp_path))
+    registry.inc("hits", LABELS)
+    assert registry.collect()[0] == {("hits", LABELS): 6}
+    registry.inc("hits", LABELS)
+    assert registry.collect()[0] == {("hits", LABELS): 7}
+
+
+def test_unwind_closes_render_left_by_exception():
+    timer = metrics.RequestTimer()
+    timer.push("render")
+    timer.push("render")
+    timer.unwind("render")
+    timer.push("write")
+    timer.pop()
+    assert not timer._stack
+    assert set(timer.phases) == {"render", "write"}
+
+
+def test_profiler_writes_slow_request(tmp_path):
+    profiler = metrics.SamplingProfiler(str(tmp_path), interval=0.001, threshold=0)
+    profiler.begin()
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+    profiler.end(threading.get_ident(), "GET /", 0.05)
+    [name] = os.listdir(tmp_path)
+    lines = (tmp_path / name).read_text(encoding="utf-8").splitlines()
+    assert lines and all(line.startswith("GET_/;") for line in lines)